@@ -141,6 +141,8 @@ class AuthManager {
                     info: result.user_info 
                 };
                 localStorage.setItem('google_credential', response.credential);
+                // Whatever the cloud holds now is the base our next delta sync is diffed against
+                this.saveSyncBase(AuthManager.normalizeLibrary(result.data), result.rev);
                 
                 // Update UI with user info
                 if (this.onUserInfo && result.user_info) {
@@ -168,20 +170,132 @@ class AuthManager {
         }
     }
 
+    // --- Delta sync ---
+    // The server stores the library per collection with a revision number. We keep a compact
+    // fingerprint of the library as of the last successful sync (the "base") and only send
+    // patches for what changed since then.
+
+    static normalizeLibrary(data) {
+        data = data || {};
+        const playlists = {};
+        for (const [name, p] of Object.entries(data.playlists || {})) {
+            playlists[name] = Array.isArray(p) ? { tracks: p, cover: null } : p; // Convert old format
+        }
+        return { likedSongs: data.likedSongs || [], recentSongs: data.recentSongs || [], playlists };
+    }
+
+    static hash(str) {
+        // cyrb53: small, fast string hash, only used to spot changed playlists
+        let h1 = 0xdeadbeef, h2 = 0x41c6ce57;
+        for (let i = 0; i < str.length; i++) {
+            const ch = str.charCodeAt(i);
+            h1 = Math.imul(h1 ^ ch, 2654435761);
+            h2 = Math.imul(h2 ^ ch, 1597334677);
+        }
+        h1 = Math.imul(h1 ^ (h1 >>> 16), 2246822507) ^ Math.imul(h2 ^ (h2 >>> 13), 3266489909);
+        h2 = Math.imul(h2 ^ (h2 >>> 16), 2246822507) ^ Math.imul(h1 ^ (h1 >>> 13), 3266489909);
+        return (4294967296 * (2097151 & h2) + (h1 >>> 0)).toString(36);
+    }
+
+    static compactLibrary(lib) {
+        const playlists = {};
+        for (const [name, p] of Object.entries(lib.playlists)) playlists[name] = AuthManager.hash(JSON.stringify(p));
+        return { liked: lib.likedSongs.map(t => t.id), recent: lib.recentSongs.map(t => t.id), playlists };
+    }
+
+    saveSyncBase(lib, rev) {
+        if (rev === undefined || rev === null) return;
+        localStorage.setItem('sync_base', JSON.stringify(AuthManager.compactLibrary(lib)));
+        localStorage.setItem('sync_rev', String(rev));
+    }
+
+    static diffLibrary(base, lib) {
+        const patches = [];
+        const baseLiked = new Set(base.liked);
+        const liked = new Set(lib.likedSongs.map(t => t.id));
+        base.liked.forEach(id => { if (!liked.has(id)) patches.push({ op: 'unlike', id }); });
+        lib.likedSongs.forEach(t => { if (!baseLiked.has(t.id)) patches.push({ op: 'like', track: t }); });
+
+        // History only ever gains tracks at the front: find how many were played since the base
+        const recent = lib.recentSongs;
+        let played = 0;
+        for (; played < recent.length; played++) {
+            const moved = new Set(recent.slice(0, played).map(t => t.id));
+            const rest = base.recent.filter(id => !moved.has(id)).slice(0, recent.length - played);
+            if (rest.join('\n') === recent.slice(played).map(t => t.id).join('\n')) break;
+        }
+        recent.slice(0, played).reverse().forEach(t => patches.push({ op: 'history', track: t }));
+
+        Object.keys(base.playlists).forEach(name => {
+            if (!(name in lib.playlists)) patches.push({ op: 'playlist_delete', name });
+        });
+        for (const [name, p] of Object.entries(lib.playlists)) {
+            if (base.playlists[name] !== AuthManager.hash(JSON.stringify(p))) patches.push({ op: 'playlist_put', name, playlist: p });
+        }
+        return patches;
+    }
+
+    static applyPatches(lib, patches) {
+        lib = AuthManager.normalizeLibrary(JSON.parse(JSON.stringify(lib)));
+        for (const p of patches) {
+            if (p.op === 'like') {
+                if (!lib.likedSongs.some(t => t.id === p.track.id)) lib.likedSongs.push(p.track);
+            } else if (p.op === 'unlike') {
+                lib.likedSongs = lib.likedSongs.filter(t => t.id !== p.id);
+            } else if (p.op === 'history') {
+                lib.recentSongs = [p.track, ...lib.recentSongs.filter(t => t.id !== p.track.id)].slice(0, 50);
+            } else if (p.op === 'playlist_put') {
+                lib.playlists[p.name] = p.playlist;
+            } else if (p.op === 'playlist_delete') {
+                delete lib.playlists[p.name];
+            }
+        }
+        return lib;
+    }
+
     async syncData(appData) {
         if (!this.user || !this.user.credential) return;
         
+        const local = AuthManager.normalizeLibrary(appData);
+        const base = JSON.parse(localStorage.getItem('sync_base') || 'null');
+        let rev = parseInt(localStorage.getItem('sync_rev'), 10);
+        // Never synced with revisions on this device: upload the whole library once
+        const patches = (base && !isNaN(rev)) ? AuthManager.diffLibrary(base, local) : null;
+
         try {
-            await fetch(`${this.baseUrl}/api/auth/sync`, {
-                method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
-                body: JSON.stringify({
-                    credential: this.user.credential,
-                    clientId: this.clientId,
-                    data: appData
-                })
-            });
-            console.log('Data synced to cloud');
+            let remote = null;
+            for (let attempt = 0; attempt < 3; attempt++) {
+                const body = { credential: this.user.credential, clientId: this.clientId };
+                if (patches) {
+                    body.rev = rev;
+                    body.patches = patches;
+                } else {
+                    body.data = local;
+                }
+                const res = await fetch(`${this.baseUrl}/api/auth/sync`, {
+                    method: 'POST',
+                    headers: { 'Content-Type': 'application/json' },
+                    body: JSON.stringify(body)
+                });
+                const result = await res.json();
+
+                if (res.status === 409) {
+                    // Another device synced first: replay our patches on top of its library
+                    remote = AuthManager.normalizeLibrary(result.data);
+                    rev = result.rev;
+                    continue;
+                }
+                if (!res.ok) throw new Error(result.error || 'Sync failed');
+
+                const merged = remote ? AuthManager.applyPatches(remote, patches) : local;
+                this.saveSyncBase(merged, result.rev);
+                if (remote && this.onDataLoaded && JSON.stringify(merged) !== JSON.stringify(local)) {
+                    this.onDataLoaded(merged);
+                }
+                console.log(result.status === 'unchanged' ? 'Cloud data already up to date' : 'Data synced to cloud');
+                return;
+            }
+            throw new Error('Sync conflict could not be resolved');
         } catch (e) {
             console.error('Sync failed', e);
         }
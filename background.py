@@ -0,0 +1,7 @@
+import threading
+
+
+def spawn_thread(fn, *args):
+    """Runs fn(*args) on a daemon thread: the default `spawn` for classes that do
+    background work. The server passes socketio.start_background_task instead."""
+    threading.Thread(target=fn, args=args, daemon=True).start()
@@ -0,0 +1,504 @@
+"""Load test and benchmark for AURA against local stand-ins for every upstream.
+
+    python benchmark.py                          # defaults, results in bench_results/
+    python benchmark.py --latency-ms 80 --requests 500 --concurrency 16
+    python benchmark.py --rooms 20 --members 8 --routes search,lyrics
+
+server.py runs in a child process (eventlet, like production) with YTMusic
+replaced by a stub, and LRCLIB and Google's cert endpoint answered by a
+transport adapter mounted on the app's own pooled sessions, all with the
+configured latency. ID tokens are signed with a throwaway RSA key whose cert
+the stub serves, so verification runs for real. Each run writes a JSON file
+with throughput and latency percentiles per route, party fan-out timings and
+server memory, so runs can be diffed over time.
+
+Socket.IO clients use websocket when the websocket-client package is
+installed and fall back to long-polling otherwise.
+
+To profile the server under load, attach a sampling profiler to the server
+process (its pid is printed at startup) while a run is going. py-spy is an
+optional dev tool, not a requirement: `pip install py-spy`, then
+`py-spy record -o profile.svg --pid <pid>`.
+"""
+import sys
+
+if __name__ == '__main__' and '--serve' in sys.argv:
+    # The server process is patched before anything below creates locks, like gunicorn's eventlet worker does
+    import eventlet
+    eventlet.monkey_patch()
+
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+CLIENT_ID = 'bench-client.apps.googleusercontent.com'
+KEY_ID = 'bench-key'
+
+
+# --- Stand-ins, installed in the server process ---
+
+def _upstream_wait(latency, jitter):
+    time.sleep(max(0, latency + random.uniform(-jitter, jitter)))
+
+
+def _tracks(seed, count=20):
+    base = zlib.crc32(str(seed).encode())
+    return [{
+        'videoId': f"v{(base + i) % 10 ** 9:09d}",
+        'title': f"Track {(base + i) % 997}",
+        'artists': [{'name': f"Artist {(base + i) % 53}", 'id': f"UC{(base + i) % 53:022d}"}],
+        'thumbnails': [{'url': f"https://i.ytimg.com/vi/v{(base + i) % 10 ** 9:09d}/hqdefault.jpg"}],
+        'duration': f"{2 + i % 3}:{(base + i) % 60:02d}",
+        'resultType': 'song',
+    } for i in range(count)]
+
+
+def _browse_item(track):
+    """A playlist row in the raw shape YouTube Music's browse endpoint returns."""
+    def column(text, endpoint):
+        return {'musicResponsiveListItemFlexColumnRenderer': {'text': {'runs': [{'text': text, 'navigationEndpoint': endpoint}]}}}
+
+    artist = track['artists'][0]
+    artist_page = {'browseEndpointContextSupportedConfigs': {'browseEndpointContextMusicConfig': {'pageType': 'MUSIC_PAGE_TYPE_ARTIST'}}}
+    return {'musicResponsiveListItemRenderer': {
+        'overlay': {'musicItemThumbnailOverlayRenderer': {'content': {'musicPlayButtonRenderer': {
+            'playNavigationEndpoint': {'watchEndpoint': {'videoId': track['videoId']}}}}}},
+        'flexColumns': [column(track['title'], {'watchEndpoint': {'videoId': track['videoId']}}),
+                        column(artist['name'], {'browseEndpoint': {'browseId': artist['id'], **artist_page}})],
+        'fixedColumns': [{'musicResponsiveListItemFixedColumnRenderer': {'text': {'runs': [{'text': track['duration']}]}}}],
+        'thumbnail': {'musicThumbnailRenderer': {'thumbnail': {'thumbnails': track['thumbnails']}}},
+    }}
+
+
+def browse_playlist_page(body, size=250, page_size=100):
+    """A stub answer to a playlist browse request: the first page for a browseId,
+    later pages for the continuation tokens it hands out."""
+    if 'continuation' in body:
+        playlist_id, _, offset = body['continuation'].rpartition(':')
+        offset = int(offset)
+    else:
+        playlist_id, offset = body['browseId'], 0
+    items = [_browse_item(t) for t in _tracks(playlist_id, size)[offset:offset + page_size]]
+    if offset + page_size < size:
+        items.append({'continuationItemRenderer': {'continuationEndpoint': {'continuationCommand': {
+            'token': f"{playlist_id}:{offset + page_size}"}}}})
+    if offset:
+        return {'onResponseReceivedActions': [{'appendContinuationItemsAction': {'continuationItems': items}}]}
+    header = {'musicResponsiveHeaderRenderer': {'title': {'runs': [{'text': f"Playlist {playlist_id}"}]}}}
+    return {'contents': {'twoColumnBrowseResultsRenderer': {
+        'tabs': [{'tabRenderer': {'content': {'sectionListRenderer': {'contents': [header]}}}}],
+        'secondaryContents': {'sectionListRenderer': {'contents': [{'musicPlaylistShelfRenderer': {'contents': items}}]}},
+    }}}
+
+
+def make_stub_ytmusic(latency, jitter):
+    class StubYTMusic:
+        def __init__(self, *args, **kwargs):
+            self.headers = {}
+
+        def search(self, query, filter=None, limit=20, **kwargs):
+            _upstream_wait(latency, jitter)
+            return _tracks(query, limit)
+
+        def get_watch_playlist(self, videoId=None, limit=25, **kwargs):
+            _upstream_wait(latency, jitter)
+            return {'tracks': _tracks(videoId, limit), 'lyrics': f"MPLY{videoId}" if zlib.crc32(videoId.encode()) % 2 else None}
+
+        def get_lyrics(self, browseId, **kwargs):
+            _upstream_wait(latency, jitter)
+            return {'lyrics': f"Lyrics for {browseId}\n" * 30}
+
+        def get_playlist(self, playlistId, limit=100, **kwargs):
+            _upstream_wait(latency, jitter)
+            return {'title': f"Playlist {playlistId}", 'tracks': _tracks(playlistId, min(limit or 100, 100))}
+
+        def get_artist(self, channelId, **kwargs):
+            _upstream_wait(latency, jitter)
+            return {'thumbnails': [{'url': f"https://img.invalid/artist/{channelId}.jpg"}]}
+
+        def _send_request(self, endpoint, body, *args):
+            # Only the playlist pager (playlist_import.py) talks to the raw API
+            _upstream_wait(latency, jitter)
+            return browse_playlist_page(body)
+
+    return StubYTMusic
+
+
+def make_stub_adapter(handler, latency, jitter):
+    from requests.adapters import HTTPAdapter
+
+    class StubAdapter(HTTPAdapter):
+        def send(self, request, **kwargs):
+            _upstream_wait(latency, jitter)
+            status, body, headers = handler(request)
+            response = requests.Response()
+            response.status_code = status
+            response._content = json.dumps(body).encode()
+            response.headers.update({'Content-Type': 'application/json', **headers})
+            response.encoding = 'utf-8'
+            response.url = request.url
+            response.request = request
+            return response
+
+    return StubAdapter()
+
+
+def lrclib_handler(request):
+    if zlib.crc32(request.url.encode()) % 10 < 3:
+        return 404, {'message': 'Not found'}, {}
+    return 200, {'syncedLyrics': '\n'.join(f"[00:{i:02d}.00] line {i}" for i in range(40))}, {}
+
+
+def serve(args):
+    import ytmusicapi
+
+    latency, jitter = args.latency_ms / 1000, args.jitter_ms / 1000
+    ytmusicapi.YTMusic = make_stub_ytmusic(latency, jitter)
+    sys.path.insert(0, REPO_DIR)
+    import server
+
+    with open(args.cert_file) as f:
+        certs = json.load(f)
+    server.lrclib_session.mount('https://lrclib.net', make_stub_adapter(lrclib_handler, latency, jitter))
+    server.google_session.mount('https://www.googleapis.com', make_stub_adapter(
+        lambda request: (200, certs, {'Cache-Control': 'public, max-age=3600'}), latency, jitter))
+    server.socketio.run(server.app, host='127.0.0.1', port=args.port, log_output=False)
+
+
+# --- Load generator ---
+
+def make_signing_key():
+    """A throwaway RSA key and the v1-style {kid: cert PEM} document the stub serves."""
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'aura-bench')])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(name).issuer_name(name).public_key(key.public_key())
+            .serial_number(x509.random_serial_number()).not_valid_before(now - datetime.timedelta(days=1))
+            .not_valid_after(now + datetime.timedelta(days=1)).sign(key, hashes.SHA256()))
+    private_pem = key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                    serialization.NoEncryption())
+    return private_pem, {KEY_ID: cert.public_bytes(serialization.Encoding.PEM).decode()}
+
+
+def make_tokens(private_pem, count):
+    from google.auth import crypt, jwt
+
+    signer = crypt.RSASigner.from_string(private_pem, key_id=KEY_ID)
+    now = int(time.time())
+    return [jwt.encode(signer, {
+        'iss': 'https://accounts.google.com', 'aud': CLIENT_ID, 'sub': f"bench-user-{i}",
+        'email': f"user{i}@bench.invalid", 'iat': now, 'exp': now + 3600,
+    }).decode() for i in range(count)]
+
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))]
+
+
+def summarize(latencies, errors, elapsed):
+    ms = [v * 1000 for v in latencies]
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'mean_ms': round(sum(ms) / len(ms), 2) if ms else None,
+        'p50_ms': round(percentile(ms, 50), 2) if ms else None,
+        'p99_ms': round(percentile(ms, 99), 2) if ms else None,
+        'max_ms': round(max(ms), 2) if ms else None,
+    }
+
+
+def rss_mb(pid):
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None  # Not Linux
+
+
+def route_requests(base, tokens, distinct):
+    """name -> fn(session, i) issuing one request. `distinct` bounds the key space, so repeats hit caches."""
+    def pick(i):
+        return random.randrange(distinct)
+
+    def sync(session, i):
+        track = {'id': f"v{i}", 'title': f"Track {i}", 'artist': 'Bench'}
+        return session.post(f"{base}/api/auth/sync", json={
+            'credential': tokens[i % len(tokens)], 'clientId': CLIENT_ID,
+            'patches': [{'op': 'history', 'track': track}]})
+
+    return {
+        'index': lambda s, i: s.get(f"{base}/", headers={'Accept-Encoding': 'gzip, br'}),
+        'search': lambda s, i: s.get(f"{base}/search", params={'q': f"query {pick(i)}"}),
+        # Prefixes of titles the search stub returns, so the catalog has matches once /search ran
+        'suggest': lambda s, i: s.get(f"{base}/suggest", params={'q': f"track {pick(i) % 100}"}),
+        'lyrics': lambda s, i: s.get(f"{base}/lyrics", params={
+            'title': f"Track {pick(i)}", 'artist': 'Bench', 'id': f"v{pick(i):09d}"}),
+        'recommend': lambda s, i: s.post(f"{base}/recommend", json={
+            'history': [f"v{pick(i):09d}", f"v{pick(i + 1):09d}", f"v{pick(i + 2):09d}"]}),
+        'import_playlist': lambda s, i: s.post(f"{base}/import_playlist", json={
+            'url': f"https://music.youtube.com/playlist?list=PLbench{pick(i)}"}),
+        # What the frontend uses: NDJSON, one line per upstream page
+        'import_playlist_stream': lambda s, i: s.post(f"{base}/import_playlist", json={
+            'url': f"https://music.youtube.com/playlist?list=PLbench{pick(i)}", 'stream': True}),
+        'get_artist_thumbnails': lambda s, i: s.post(f"{base}/get_artist_thumbnails", json=[
+            {'id': f"UC{(pick(i) + k) % 53:022d}", 'name': f"Artist {k}"} for k in range(8)]),
+        # What a track change costs in one round trip
+        'batch': lambda s, i: s.post(f"{base}/batch", json={'requests': [
+            {'id': 'lyrics', 'path': '/lyrics', 'query': {'title': f"Track {pick(i)}", 'artist': 'Bench', 'id': f"v{pick(i):09d}"}},
+            {'id': 'recommend', 'path': '/recommend', 'method': 'POST', 'body': {'history': [f"v{pick(i):09d}"]}},
+            {'id': 'artists', 'path': '/get_artist_thumbnails', 'method': 'POST',
+             'body': [{'id': f"UC{pick(i) % 53:022d}", 'name': 'Bench'}]},
+        ]}),
+        'login': lambda s, i: s.post(f"{base}/api/auth/login", json={
+            'credential': tokens[i % len(tokens)], 'clientId': CLIENT_ID}),
+        'sync': sync,
+    }
+
+
+def run_http(fn, total, concurrency):
+    local = threading.local()
+    latencies, errors = [], [0]
+    lock = threading.Lock()
+
+    def one(i):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = fn(local.session, i)
+            response.content  # Streamed bodies count until fully read
+            ok = response.status_code < 500
+        except requests.RequestException:
+            ok = False
+        elapsed = time.perf_counter() - start
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors[0] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    return summarize(latencies, errors[0], time.perf_counter() - start)
+
+
+def run_party(base, server_pid, rooms, members, actions, seek_burst, interval, settle):
+    import socketio
+
+    try:
+        import websocket  # noqa: F401 -- only checking it's installed
+        transports = ['websocket']
+    except ImportError:
+        transports = ['polling']
+
+    deliveries = defaultdict(list)  # marker -> receive times
+    sent = {}
+    received = defaultdict(int)
+    lock = threading.Lock()
+
+    def record(event, payload):
+        now = time.perf_counter()
+        markers = []
+        if event == 'party_update':
+            markers = [op['song'].get('marker') for op in payload.get('ops', []) if op.get('op') == 'insert']
+        elif event == 'party_chat':
+            markers = [payload.get('marker')]
+        with lock:
+            received[event] += 1
+            for marker in markers:
+                if marker:
+                    deliveries[marker].append(now)
+
+    clients = []
+    rss_before = rss_mb(server_pid)
+    join_start = time.perf_counter()
+    for r in range(rooms):
+        for m in range(members):
+            client = socketio.Client(reconnection=False)
+            for event in ('party_update', 'party_chat', 'typing', 'party_users', 'party_state_update'):
+                client.on(event, lambda payload=None, event=event: record(event, payload or {}))
+            client.connect(base, transports=transports, wait_timeout=10)
+            client.emit('join_party', {'room': f"bench-{r}", 'username': f"u{r}-{m}", 'userId': f"u{r}-{m}"})
+            clients.append((r, m, client))
+    join_elapsed = time.perf_counter() - join_start
+    time.sleep(settle)
+    rss_joined = rss_mb(server_pid)
+
+    action_start = time.perf_counter()
+    for k in range(actions):
+        for r, m, client in clients:
+            if m != 0:
+                continue
+            marker = f"q{r}-{k}"
+            sent[marker] = time.perf_counter()
+            client.emit('party_action', {'type': 'add_to_queue', 'song': {
+                'id': marker, 'title': f"Song {k}", 'artist': 'Bench', 'marker': marker}})
+            marker = f"c{r}-{k}"
+            sent[marker] = time.perf_counter()
+            client.emit('party_chat', {'username': 'host', 'message': f"hi {k}", 'marker': marker})
+            client.emit('typing', {'username': 'host'})
+            for s in range(seek_burst):
+                client.emit('party_action', {'type': 'seek', 'time': k * 10 + s})
+        time.sleep(interval)
+    action_elapsed = time.perf_counter() - action_start
+    time.sleep(settle)
+    rss_after = rss_mb(server_pid)
+
+    for _, _, client in clients:
+        client.disconnect()
+
+    # Time from emit until the last member of the room had it
+    fanout = [max(deliveries[marker]) - sent[marker] for marker in sent if len(deliveries[marker]) == members]
+    incomplete = sum(1 for marker in sent if len(deliveries[marker]) < members)
+    seeks_sent = rooms * actions * seek_burst
+    per_room_mb = None
+    if rss_before is not None and rss_after is not None:
+        per_room_mb = round((rss_after - rss_before) / rooms, 3)
+    return {
+        'transport': transports[0],
+        'rooms': rooms,
+        'members': members,
+        'join_seconds': round(join_elapsed, 3),
+        'actions_seconds': round(action_elapsed, 3),
+        'events_emitted': len(sent) + rooms * actions * (1 + seek_burst),
+        'fanout': {k: v for k, v in summarize(fanout, incomplete, action_elapsed).items()
+                   if k not in ('requests', 'errors', 'throughput_rps')} | {'delivered': len(fanout), 'incomplete': incomplete},
+        # Queue adds plus whatever the seek bursts were coalesced into
+        'party_updates_received_per_member': round(received['party_update'] / (rooms * members), 2),
+        'seeks_sent_per_room': seeks_sent // rooms if rooms else 0,
+        'typing_received': received['typing'],
+        'rss_mb': {'before': rss_before, 'joined': rss_joined, 'after': rss_after},
+        'rss_mb_per_room': per_room_mb,
+    }
+
+
+def wait_until_up(base, proc, log_path, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"Server exited with {proc.returncode}, see {log_path}")
+        try:
+            if requests.get(f"{base}/health", timeout=1).ok:
+                return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError('Server did not come up')
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--latency-ms', type=float, default=50, help='stub upstream latency')
+    parser.add_argument('--jitter-ms', type=float, default=10)
+    parser.add_argument('--routes', default='index,search,suggest,lyrics,recommend,import_playlist,import_playlist_stream,get_artist_thumbnails,batch,login,sync')
+    parser.add_argument('--requests', type=int, default=300, help='requests per route')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--distinct', type=int, default=50, help='distinct keys per route (smaller = more cache hits)')
+    parser.add_argument('--users', type=int, default=20, help='distinct signed-in users')
+    parser.add_argument('--rooms', type=int, default=10)
+    parser.add_argument('--members', type=int, default=5)
+    parser.add_argument('--actions', type=int, default=20, help='queue adds/chats per room')
+    parser.add_argument('--seek-burst', type=int, default=10, help='seeks sent after each action')
+    parser.add_argument('--interval-ms', type=float, default=50, help='pause between action rounds')
+    parser.add_argument('--keep-rate-limits', action='store_true', help="don't raise the per-socket limits")
+    parser.add_argument('--out', help='result file (default: bench_results/<timestamp>.json)')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--cert-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        return serve(args)
+
+    private_pem, certs = make_signing_key()
+    tokens = make_tokens(private_pem, args.users)
+    workdir = tempfile.mkdtemp(prefix='aura-bench-')
+    cert_file = os.path.join(workdir, 'certs.json')
+    with open(cert_file, 'w') as f:
+        json.dump(certs, f)
+
+    env = dict(os.environ, PARTY_STORE=os.environ.get('PARTY_STORE', 'sqlite'))
+    if not args.keep_rate_limits:
+        env.update(PARTY_ACTION_RATE='10000', PARTY_ACTION_BURST='10000', PARTY_CHAT_RATE='10000',
+                   PARTY_CHAT_BURST='10000', PARTY_TYPING_INTERVAL='0.0001')
+    # The server keeps its databases in the working directory: use a fresh one per run
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    proc = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), '--serve', '--port', str(args.port), '--cert-file', cert_file,
+         '--latency-ms', str(args.latency_ms), '--jitter-ms', str(args.jitter_ms)],
+        cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_until_up(base, proc, log.name)
+        print(f"Server up (pid {proc.pid}), log in {log.name}")
+        # Users have to exist before they can sync
+        for token in tokens:
+            requests.post(f"{base}/api/auth/login", json={'credential': token, 'clientId': CLIENT_ID})
+
+        results = {
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+            'git_revision': git_revision(),
+            'config': {k: v for k, v in vars(args).items() if k not in ('serve', 'cert_file', 'out')},
+            'http': {},
+        }
+        routes = route_requests(base, tokens, args.distinct)
+        for name in args.routes.split(','):
+            results['http'][name] = run_http(routes[name], args.requests, args.concurrency)
+            r = results['http'][name]
+            print(f"{name:24} {r['throughput_rps']:>8} req/s  p50 {r['p50_ms']} ms  p99 {r['p99_ms']} ms  errors {r['errors']}")
+
+        if args.rooms and args.members:
+            party = results['party'] = run_party(base, proc.pid, args.rooms, args.members, args.actions,
+                                                 args.seek_burst, args.interval_ms / 1000, settle=1.0)
+            print(f"{'party fan-out':24} p50 {party['fanout']['p50_ms']} ms  p99 {party['fanout']['p99_ms']} ms  "
+                  f"{party['rss_mb_per_room']} MB/room ({party['transport']})")
+
+        results['server'] = {'rss_mb': rss_mb(proc.pid), 'cache_stats': requests.get(f"{base}/cache_stats").json()}
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        log.close()
+
+    out = args.out or os.path.join(REPO_DIR, 'bench_results',
+                                   datetime.datetime.now().strftime('%Y%m%d-%H%M%S') + '.json')
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {out}")
+
+
+if __name__ == '__main__':
+    main()
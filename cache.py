@@ -0,0 +1,147 @@
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from background import spawn_thread
+
+
+def _sizeof(value):
+    """Rough size of a cached value in bytes (its JSON encoding)."""
+    try:
+        return len(json.dumps(value, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+class TTLCache:
+    """In-process LRU cache with a TTL and stale-while-revalidate refreshes.
+
+    Entries younger than `ttl` are fresh. Entries younger than `ttl + stale_ttl`
+    are served immediately while a single background refresh replaces them.
+    The cache is bounded both by entry count and by the approximate encoded
+    size of the stored values.
+    """
+
+    def __init__(self, name, ttl, stale_ttl=0, max_entries=1024, max_bytes=8 * 1024 * 1024, spawn=None):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._spawn = spawn or spawn_thread
+        self._data = OrderedDict()  # key -> [value, stored_at, size]
+        self._bytes = 0
+        self._refreshing = set()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.refresh_errors = 0
+
+    def get(self, key, default=None):
+        """Returns a fresh or stale value without triggering a refresh."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or time.monotonic() - entry[1] >= self.ttl + self.stale_ttl:
+                return default
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def get_or_load(self, key, loader):
+        now = time.monotonic()
+        refresh = False
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                age = now - entry[1]
+                if age < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                if age < self.ttl + self.stale_ttl:
+                    self._data.move_to_end(key)
+                    self.stale_hits += 1
+                    if key not in self._refreshing:
+                        self._refreshing.add(key)
+                        refresh = True
+                    value = entry[0]
+                else:
+                    self._remove(key)
+                    entry = None
+            if entry is None:
+                self.misses += 1
+
+        if entry is not None:
+            if refresh:
+                self._spawn(lambda: self._refresh(key, loader))
+            return value
+
+        value = loader()
+        self.set(key, value)
+        return value
+
+    def _refresh(self, key, loader):
+        try:
+            self.set(key, loader())
+        except Exception as e:
+            self.refresh_errors += 1
+            print(f"Cache Refresh Error ({self.name}): {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def set(self, key, value, stored_at=None):
+        size = _sizeof(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = [value, time.monotonic() if stored_at is None else stored_at, size]
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._data.pop(key)
+        self._bytes -= entry[2]
+
+    def dump(self, limit=None):
+        """Live entries as [key, value, wall-clock time stored], least recently used first."""
+        now, wall = time.monotonic(), time.time()
+        with self._lock:
+            entries = [[key, entry[0], wall - (now - entry[1])] for key, entry in self._data.items()
+                       if now - entry[1] < self.ttl + self.stale_ttl]
+        return entries[-limit:] if limit else entries
+
+    def restore(self, entries):
+        """Loads dump() output (e.g. back from JSON, where tuple keys became lists)."""
+        now, wall = time.monotonic(), time.time()
+        for key, value, stored in entries:
+            age = max(0, wall - stored)
+            if age < self.ttl + self.stale_ttl:
+                self.set(tuple(key) if isinstance(key, list) else key, value, stored_at=now - age)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'hits': self.hits,
+                'stale_hits': self.stale_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'refresh_errors': self.refresh_errors,
+            }
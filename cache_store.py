@@ -0,0 +1,111 @@
+import re
+import time
+
+from storage import Database
+
+CACHE_DB = 'aura_cache.db'
+
+
+def normalize_text(text):
+    """Lowercase, drop bracketed suffixes like (Official Video) and collapse whitespace."""
+    if not text:
+        return ''
+    text = re.sub(r'[\(\[].*?[\)\]]', ' ', text.lower())
+    return ' '.join(text.split())
+
+
+class LyricsStore:
+    """SQLite-backed lyrics cache, keyed on video id and normalized title/artist.
+
+    "Not available" answers are remembered too, with their own shorter expiry,
+    so a track without lyrics doesn't walk the whole upstream chain on every play.
+    A found answer is stored only under the key it was found by.
+    """
+
+    def __init__(self, db=None, ttl=30 * 86400, negative_ttl=6 * 3600):
+        self.db = db or Database(CACHE_DB)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        with self.db.transaction() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS lyrics
+                            (key TEXT PRIMARY KEY, lyrics TEXT, synced INTEGER, found INTEGER, expires_at REAL)''')
+
+    @staticmethod
+    def keys(video_id=None, title=None, artist=None):
+        # Title first: LRCLIB, the preferred source, answers by title/artist
+        keys = []
+        if title and artist:
+            keys.append(f"t:{normalize_text(title)}|{normalize_text(artist)}")
+        if video_id:
+            keys.append(f"id:{video_id}")
+        return keys
+
+    def get(self, video_id=None, title=None, artist=None):
+        """Returns {'lyrics', 'synced', 'found'} or None when nothing usable is cached."""
+        keys = self.keys(video_id, title, artist)
+        if not keys:
+            return None
+        rows = self.db.execute(
+            f"SELECT key, lyrics, synced, found FROM lyrics WHERE key IN ({','.join('?' * len(keys))}) AND expires_at > ?",
+            (*keys, time.time()),
+        )
+
+        by_key = {row[0]: row for row in rows}
+        for key in keys:
+            row = by_key.get(key)
+            if row and row[3]:
+                return {'lyrics': row[1], 'synced': bool(row[2]), 'found': True}
+        # Only trust a negative answer if every key we could look under says so
+        if len(by_key) == len(keys):
+            return {'lyrics': None, 'synced': False, 'found': False}
+        return None
+
+    def put(self, result, video_id=None, title=None, artist=None):
+        """Stores a resolved result; pass None to record that no lyrics exist."""
+        keys = self.keys(video_id, title, artist)
+        if not keys:
+            return
+        found = bool(result and result.get('lyrics'))
+        expires_at = time.time() + (self.ttl if found else self.negative_ttl)
+        rows = [
+            (key, result['lyrics'] if found else None, int(bool(found and result.get('synced'))), int(found), expires_at)
+            for key in keys
+        ]
+        # A miss must not clobber lyrics found earlier under the same title/artist
+        self.db.executemany('''INSERT INTO lyrics (key, lyrics, synced, found, expires_at) VALUES (?, ?, ?, ?, ?)
+                               ON CONFLICT(key) DO UPDATE SET lyrics = excluded.lyrics, synced = excluded.synced,
+                                   found = excluded.found, expires_at = excluded.expires_at
+                               WHERE excluded.found = 1 OR lyrics.found = 0 OR lyrics.expires_at <= ?''',
+                            [row + (time.time(),) for row in rows])
+
+
+class ThumbnailStore:
+    """SQLite-backed browseId -> artist thumbnail URL cache with a long expiry."""
+
+    def __init__(self, db=None, ttl=14 * 86400):
+        self.db = db or Database(CACHE_DB)
+        self.ttl = ttl
+        with self.db.transaction() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS artist_thumbs
+                            (browse_id TEXT PRIMARY KEY, thumbnail TEXT, expires_at REAL)''')
+
+    def get_many(self, browse_ids):
+        """Returns {browse_id: thumbnail} for the ids that are cached and unexpired."""
+        browse_ids = list(set(browse_ids))
+        found = {}
+        # Stay well under SQLite's bound-parameter limit
+        for i in range(0, len(browse_ids), 500):
+            chunk = browse_ids[i:i + 500]
+            rows = self.db.execute(
+                f"SELECT browse_id, thumbnail FROM artist_thumbs WHERE browse_id IN ({','.join('?' * len(chunk))}) AND expires_at > ?",
+                (*chunk, time.time()),
+            )
+            found.update(rows)
+        return found
+
+    def put_many(self, thumbnails):
+        if not thumbnails:
+            return
+        expires_at = time.time() + self.ttl
+        self.db.executemany("INSERT OR REPLACE INTO artist_thumbs (browse_id, thumbnail, expires_at) VALUES (?, ?, ?)",
+                            [(browse_id, thumb, expires_at) for browse_id, thumb in thumbnails.items()])
@@ -0,0 +1,146 @@
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+from background import spawn_thread
+from cache_store import CACHE_DB, normalize_text
+from storage import Database, WriteBehind
+
+_VIDEO_ID = re.compile(r'^[\w-]{6,64}$')
+_THUMB_HOSTS = ('ytimg.com', 'googleusercontent.com')
+
+
+def _thumb(url):
+    """`url` if it's an https image on YouTube's own hosts, else ''."""
+    if not isinstance(url, str) or len(url) > 1000:
+        return ''
+    try:
+        parts = urlsplit(url)
+    except ValueError:
+        return ''
+    host = parts.hostname or ''
+    if parts.scheme != 'https' or not any(host == h or host.endswith('.' + h) for h in _THUMB_HOSTS):
+        return ''
+    return url
+
+
+def _clean(track):
+    """A `_format_track`-shaped dict with sane types and sizes, or None."""
+    if not isinstance(track, dict):
+        return None
+    track_id, title = track.get('id'), track.get('title')
+    if not isinstance(track_id, str) or not _VIDEO_ID.match(track_id) or not isinstance(title, str) or not title.strip():
+        return None
+    artist = track.get('artist') if isinstance(track.get('artist'), str) else 'Unknown'
+    artist_id = track.get('artistId') if isinstance(track.get('artistId'), str) else None
+    thumb = _thumb(track.get('thumb'))
+    duration = track.get('duration') if isinstance(track.get('duration'), int) else 0
+    return {'id': track_id, 'title': title[:300], 'artist': artist[:200], 'artistId': artist_id and artist_id[:64],
+            'thumb': thumb, 'duration': duration}
+
+
+def match_query(text, prefix=True):
+    """An FTS5 query matching every word of `text`, the last one as a prefix (None if there are no words)."""
+    words = re.findall(r'\w+', normalize_text(text))[:8]
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    if prefix:
+        terms[-1] += '*'
+    return ' '.join(terms)
+
+
+class TrackCatalog:
+    """Every track the server has seen, in an SQLite FTS5 index over title and artist.
+
+    Only tracks from upstream answers are added, never ones clients sent (their
+    titles end up in other people's search results), and the newest answer
+    overwrites what's stored. Additions are batched through a WriteBehind, so
+    feeding the catalog costs a request nothing. Matches rank by relevance, boosted by how often a track was seen.
+    The oldest tracks beyond `max_tracks` are pruned.
+    """
+
+    def __init__(self, db=None, max_tracks=200000, write_window=1.0, spawn=None, sleep=time.sleep):
+        self.db = db or Database(CACHE_DB)
+        self.max_tracks = max_tracks
+        self._spawn = spawn or spawn_thread
+        self._added = 0
+        self._lock = threading.Lock()
+        with self.db.transaction() as conn:
+            conn.execute('''CREATE TABLE IF NOT EXISTS catalog
+                            (id TEXT PRIMARY KEY, title TEXT, artist TEXT, artist_id TEXT, thumb TEXT,
+                             duration INTEGER, seen INTEGER, seen_at REAL)''')
+            conn.execute('''CREATE VIRTUAL TABLE IF NOT EXISTS catalog_fts USING fts5
+                            (title, artist, content='catalog', content_rowid='rowid',
+                             tokenize='unicode61 remove_diacritics 2', prefix='2 3')''')
+            # Keep the external-content index in step with the table
+            conn.execute('''CREATE TRIGGER IF NOT EXISTS catalog_ai AFTER INSERT ON catalog BEGIN
+                                INSERT INTO catalog_fts (rowid, title, artist) VALUES (new.rowid, new.title, new.artist);
+                            END''')
+            conn.execute('''CREATE TRIGGER IF NOT EXISTS catalog_ad AFTER DELETE ON catalog BEGIN
+                                INSERT INTO catalog_fts (catalog_fts, rowid, title, artist) VALUES ('delete', old.rowid, old.title, old.artist);
+                            END''')
+            conn.execute('''CREATE TRIGGER IF NOT EXISTS catalog_au AFTER UPDATE OF title, artist ON catalog
+                            WHEN old.title IS NOT new.title OR old.artist IS NOT new.artist BEGIN
+                                INSERT INTO catalog_fts (catalog_fts, rowid, title, artist) VALUES ('delete', old.rowid, old.title, old.artist);
+                                INSERT INTO catalog_fts (rowid, title, artist) VALUES (new.rowid, new.title, new.artist);
+                            END''')
+        self.prune()
+        self.writes = WriteBehind(self.db, self._flush, window=write_window, spawn=self._spawn, sleep=sleep)
+
+    def add(self, tracks):
+        """Queues `_format_track`-shaped tracks; malformed ones are skipped."""
+        added = 0
+        for track in tracks or ():
+            track = _clean(track)
+            if track:
+                self.writes.submit(track['id'], track)
+                added += 1
+        with self._lock:
+            self._added += added
+            prune = self._added >= max(1000, self.max_tracks // 20)
+            if prune:
+                self._added = 0
+        if prune:
+            self._spawn(self.prune)
+
+    def _flush(self, conn, track_id, items):
+        track = items[-1]
+        row = (track['id'], track['title'], track['artist'], track['artistId'], track['thumb'], track['duration'],
+               len(items), time.time())
+        conn.execute('''INSERT INTO catalog (id, title, artist, artist_id, thumb, duration, seen, seen_at)
+                        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                        ON CONFLICT(id) DO UPDATE SET title = excluded.title, artist = excluded.artist,
+                            artist_id = COALESCE(excluded.artist_id, artist_id),
+                            thumb = COALESCE(NULLIF(excluded.thumb, ''), thumb),
+                            duration = COALESCE(NULLIF(excluded.duration, 0), duration),
+                            seen = seen + excluded.seen, seen_at = excluded.seen_at''', row)
+
+    def prune(self):
+        try:
+            with self.db.transaction() as conn:
+                count = conn.execute("SELECT COUNT(*) FROM catalog").fetchone()[0]
+                if count > self.max_tracks:
+                    conn.execute("DELETE FROM catalog WHERE rowid IN (SELECT rowid FROM catalog ORDER BY seen_at LIMIT ?)",
+                                 (count - self.max_tracks,))
+        except Exception as e:
+            print(f"Catalog Prune Error: {e}")
+
+    def search(self, text, limit=20, prefix=True):
+        """Tracks matching every word of `text`, best first, as `_format_track` dicts."""
+        query = match_query(text, prefix)
+        if not query:
+            return []
+        # bm25 is negative (lower is better): scale it up for tracks seen often
+        rows = self.db.execute('''SELECT c.id, c.title, c.artist, c.artist_id, c.thumb, c.duration
+                                  FROM catalog_fts JOIN catalog c ON c.rowid = catalog_fts.rowid
+                                  WHERE catalog_fts MATCH ?
+                                  ORDER BY bm25(catalog_fts, 2.0, 1.0) * (1 + 0.1 * MIN(c.seen, 20)) LIMIT ?''',
+                               (query, limit))
+        # Rows stored before client tracks were turned away may still have an odd thumb
+        return [{'id': r[0], 'title': r[1], 'artist': r[2], 'artistId': r[3], 'thumb': _thumb(r[4]), 'duration': r[5]}
+                for r in rows]
+
+    def stats(self):
+        return {'tracks': self.db.execute("SELECT COUNT(*) FROM catalog")[0][0], **self.writes.stats()}
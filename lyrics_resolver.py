@@ -0,0 +1,90 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from upstream import submit_with_deadline
+
+
+class LyricsResolver:
+    """Races the lyrics sources concurrently while keeping their preference order.
+
+    LRCLIB and the YouTube lookup by video id start together, each with its own
+    deadline. A lower-ranked answer is only returned once every higher-ranked
+    source has settled (answered, found nothing, failed or timed out). The
+    search-based fallback starts as soon as the lookup by id comes back empty,
+    overlapping with whatever LRCLIB is still doing.
+
+    Sources return {'lyrics', 'synced'}, None when they have nothing, or raise.
+    """
+
+    def __init__(self, fetch_lrclib, fetch_yt, find_official_id, executor=None,
+                 lrclib_timeout=3.0, yt_timeout=5.0, fallback_timeout=6.0):
+        self.fetch_lrclib = fetch_lrclib
+        self.fetch_yt = fetch_yt
+        self.find_official_id = find_official_id
+        self.executor = executor or ThreadPoolExecutor(max_workers=8)
+        self.lrclib_timeout = lrclib_timeout
+        self.yt_timeout = yt_timeout
+        self.fallback_timeout = fallback_timeout
+
+    def _fallback(self, title, artist, video_id):
+        official_id = self.find_official_id(title, artist)
+        if not official_id or official_id == video_id:
+            return None
+        return self.fetch_yt(official_id)
+
+    def resolve(self, title, artist, video_id):
+        """Returns (result, source, complete). `source` names the source that answered
+        ('lrclib', 'yt' or 'fallback', None without a result). `complete` is False
+        when a source failed or timed out, i.e. a None result shouldn't be
+        remembered as "no lyrics"."""
+        start = time.monotonic()
+        # Ordered by preference: [name, future, deadline]
+        sources = []
+        if title and artist:
+            sources.append(['lrclib', submit_with_deadline(self.executor, self.fetch_lrclib, title, artist), start + self.lrclib_timeout])
+        if video_id:
+            sources.append(['yt', submit_with_deadline(self.executor, self.fetch_yt, video_id), start + self.yt_timeout])
+        if not sources:
+            return None, None, True
+
+        complete = True
+        fallback_started = False
+        while True:
+            now = time.monotonic()
+            states = {}
+            for name, future, deadline in sources:
+                if future.done():
+                    try:
+                        result = future.result()
+                    except Exception:
+                        result = None
+                        complete = False
+                    states[name] = result if result and result.get('lyrics') else None
+                elif now >= deadline:
+                    complete = False
+                    states[name] = None
+                else:
+                    states[name] = 'pending'
+
+            if not fallback_started and video_id and title and artist and states['yt'] is None:
+                # The lookup by id came back empty: start the search fallback now,
+                # overlapping with whatever LRCLIB is still doing
+                fallback_started = True
+                sources.append(['fallback', submit_with_deadline(self.executor, self._fallback, title, artist, video_id),
+                                now + self.fallback_timeout])
+                states['fallback'] = 'pending'
+
+            waiting_on = None
+            for source in sources:
+                state = states[source[0]]
+                if state == 'pending':
+                    waiting_on = source
+                    break
+                if state is not None:
+                    return state, source[0], complete
+
+            if waiting_on is None:
+                return None, None, complete
+            # Wake up on the next completion or when the blocking source runs out of time
+            pending = [s[1] for s in sources if not s[1].done()]
+            wait(pending, timeout=max(0, waiting_on[2] - now), return_when=FIRST_COMPLETED)
@@ -0,0 +1,179 @@
+import time
+
+OPS_LOG_LIMIT = 200
+
+
+def new_state():
+    """Returns a fresh room state.
+
+    The queue is a dict of song id -> song, which keeps play order and makes
+    membership, append and remove O(1). Every change bumps `version` and is
+    recorded as a small op in a bounded log, so members get the op instead of the
+    whole queue and a reconnecting client can catch up from the version it last saw.
+    A reset isn't kept: it would put a second copy of the queue in the room, so
+    the log starts over after it and anyone further behind gets a snapshot.
+
+        {'v': 7, 'op': 'insert', 'song': {...}, 'index': 3}
+        {'v': 8, 'op': 'move', 'id': ..., 'index': 0}
+        {'v': 9, 'op': 'remove', 'id': ...}
+        {'v': 10, 'op': 'reset', 'queue': [...]}       when a diff would be bigger
+        {'v': 11, 'op': 'playback', 'song'?: {...}, 'isPlaying': ..., 'time': ..., 'at': ...}
+
+    `time` is the position at server time `at` (see position()). State stays
+    plain JSON so any party store can hold it.
+    """
+    return {'song': None, 'isPlaying': False, 'time': 0, 'at': time.time(), 'queue': {}, 'version': 0, 'ops': []}
+
+
+def upgrade(state):
+    """Brings a room saved before versioning (queue as a list) up to date, in place."""
+    if isinstance(state.get('queue'), list):
+        state['queue'] = {s['id']: s for s in state['queue'] if isinstance(s, dict) and s.get('id')}
+    state.setdefault('version', 0)
+    state.setdefault('ops', [])
+    state.setdefault('at', time.time())
+    return state
+
+
+def position(state, now=None):
+    """The playhead right now: the stored position plus the time played since.
+
+    The anchor is wall-clock time, because it has to mean the same thing in
+    every worker and after a restart, which a monotonic clock doesn't. A clock
+    stepping backwards never moves the playhead back.
+    """
+    if not state['isPlaying']:
+        return state['time']
+    now = time.time() if now is None else now
+    return state['time'] + max(0, now - state['at'])
+
+
+def snapshot(state):
+    """The full state as clients see it: the queue as an ordered list and the
+    playhead as of `serverTs`."""
+    now = time.time()
+    return {
+        'song': state['song'],
+        'isPlaying': state['isPlaying'],
+        'time': position(state, now),
+        'serverTs': now,
+        'queue': list(state['queue'].values()),
+        'version': state['version'],
+    }
+
+
+def heartbeat(state):
+    """Compact [version, position, server_ts] for periodic playhead sync."""
+    now = time.time()
+    return [state['version'], round(position(state, now), 3), round(now, 3)]
+
+
+def upcoming(state):
+    """Queued songs after the one playing (the whole queue if it isn't in it)."""
+    songs = list(state['queue'].values())
+    current = state['song'].get('id') if isinstance(state['song'], dict) else None
+    if current in state['queue']:
+        return songs[list(state['queue']).index(current) + 1:]
+    return songs
+
+
+def ops_since(state, version):
+    """Ops after `version`, or None when the log no longer reaches back that far."""
+    if not isinstance(version, int) or version > state['version']:
+        return None
+    oldest = state['ops'][0]['v'] if state['ops'] else state['version'] + 1
+    if version + 1 < oldest:
+        return None
+    return [op for op in state['ops'] if op['v'] > version]
+
+
+def _record(state, op):
+    state['version'] += 1
+    op['v'] = state['version']
+    if op['op'] == 'reset':
+        state['ops'] = []
+    else:
+        state['ops'].append(op)
+        del state['ops'][:-OPS_LOG_LIMIT]
+    return op
+
+
+def _is_index(index):
+    return isinstance(index, int) and not isinstance(index, bool)
+
+
+def _rebuild(queue, order, songs):
+    queue.clear()
+    queue.update((song_id, songs[song_id]) for song_id in order)
+
+
+def playback(state, **fields):
+    """Changes song/isPlaying/time. Without a `time`, the position carries on from the current playhead."""
+    now = time.time()
+    fields.setdefault('time', position(state, now))
+    state.update(fields, at=now)
+    return _record(state, {'op': 'playback', **fields, 'at': now})
+
+
+def insert(state, song, index=None):
+    """Adds a song (at the end by default). Returns the op, or None if it's already queued or invalid."""
+    queue = state['queue']
+    if not isinstance(song, dict) or not song.get('id') or song['id'] in queue:
+        return None
+    if index is not None and not _is_index(index):
+        return None
+    if index is None or index >= len(queue):
+        index = len(queue)
+        queue[song['id']] = song
+    else:
+        index = max(index, 0)
+        order = list(queue)
+        order.insert(index, song['id'])
+        _rebuild(queue, order, {**queue, song['id']: song})
+    return _record(state, {'op': 'insert', 'song': song, 'index': index})
+
+
+def remove(state, song_id):
+    if state['queue'].pop(song_id, None) is None:
+        return None
+    return _record(state, {'op': 'remove', 'id': song_id})
+
+
+def move(state, song_id, index):
+    queue = state['queue']
+    if song_id not in queue or not _is_index(index):
+        return None
+    order = [i for i in queue if i != song_id]
+    index = min(max(index, 0), len(order))
+    if list(queue).index(song_id) == index:
+        return None
+    order.insert(index, song_id)
+    _rebuild(queue, order, dict(queue))
+    return _record(state, {'op': 'move', 'id': song_id, 'index': index})
+
+
+def set_queue(state, songs):
+    """Replaces the queue, returning the ops that turn the old one into the new one."""
+    queue = state['queue']
+    new = {}
+    for song in songs:
+        if isinstance(song, dict) and song.get('id') and song['id'] not in new:
+            new[song['id']] = song
+
+    ops = [{'op': 'remove', 'id': song_id} for song_id in queue if song_id not in new]
+    order = [song_id for song_id in queue if song_id in new]
+    for index, song_id in enumerate(new):
+        if index < len(order) and order[index] == song_id:
+            continue
+        if song_id in queue:
+            order.remove(song_id)
+            ops.append({'op': 'move', 'id': song_id, 'index': index})
+        else:
+            ops.append({'op': 'insert', 'song': new[song_id], 'index': index})
+        order.insert(index, song_id)
+
+    _rebuild(queue, new, new)
+    if len(ops) > len(new) // 2 + 1:
+        # Mostly a different queue: one reset is cheaper than the diff
+        return [_record(state, {'op': 'reset', 'queue': list(new.values())})]
+    return [_record(state, op) for op in ops]
@@ -0,0 +1,342 @@
+import atexit
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from storage import Database
+
+PARTY_DB = 'aura_party.db'
+ROOM_TTL = 24 * 3600  # Rooms nobody touched for this long are dropped
+BOOT_TTL = 60  # A process that hasn't called reap() for this long is taken for dead
+
+
+class PartyStore:
+    """Where Listen Along rooms and socket -> room bindings live.
+
+    A room is a JSON-able dict: {'host': sid, 'users': {sid: user}, 'state': {...}}.
+    Changes go through `room()`, which holds the room exclusively for the block
+    and saves it afterwards, so several workers can share one store. Sockets
+    bound by this process are released at exit, but their rooms are kept so a
+    restarted server picks the party up where it left off.
+
+    A process that dies without exiting (killed, crashed) can't release its
+    sockets, so every binding records the process's boot id, and reap(),
+    called regularly by every process, releases the sockets of boot ids that
+    stopped showing up. Rooms that leaves empty are deleted.
+    """
+
+    def __init__(self, boot_ttl=BOOT_TTL):
+        self.boot = uuid.uuid4().hex
+        self.boot_ttl = boot_ttl
+        self._local = {}  # sid -> room for sockets bound by this process
+        self._local_lock = threading.Lock()
+        atexit.register(self.release_local)
+
+    @contextmanager
+    def room(self, room_id, create=None, keep_empty=False):
+        """Yields the room (or None if it doesn't exist and `create` isn't given).
+
+        `create()` builds a new room. When the block removes the last user the
+        room is deleted, unless `keep_empty` is set.
+        """
+        with self._begin(room_id) as txn:
+            data = txn.load()
+            if data is None and create:
+                data = create()
+            had_users = bool(data and data['users'])
+            yield data
+            if data is None:
+                return
+            if had_users and not data['users'] and not keep_empty:
+                txn.delete()
+            else:
+                txn.save(data)
+
+    def bind(self, sid, room_id):
+        with self._local_lock:
+            self._local[sid] = room_id
+        self._bind(sid, room_id)
+
+    def unbind(self, sid):
+        """Forgets the socket's room and returns it (None if it had none)."""
+        with self._local_lock:
+            self._local.pop(sid, None)
+        return self._unbind(sid)
+
+    def local_bindings(self):
+        """(sid, room) for the sockets this process holds."""
+        with self._local_lock:
+            return list(self._local.items())
+
+    def release_local(self):
+        """Takes this process's sockets out of their rooms, keeping the rooms."""
+        with self._local_lock:
+            sids, self._local = self._local, {}
+        for sid in sids:
+            self._release(sid)
+
+    def _release(self, sid, keep_empty=True):
+        """Unbinds the socket and takes it out of its room; returns the room if it was in one."""
+        room_id = self._unbind(sid)
+        if not room_id:
+            return None
+        with self.room(room_id, keep_empty=keep_empty) as data:
+            if not data or not data['users'].pop(sid, None):
+                return None
+            if data['host'] == sid:
+                data['host'] = next(iter(data['users']), None)
+        return room_id
+
+    def reap(self):
+        """Marks this process alive and releases the sockets of processes that
+        stopped doing so. Returns the rooms that lost members."""
+        self._touch()
+        rooms = set()
+        for boot in self._dead_boots():
+            for sid in self._boot_sids(boot):
+                room_id = self._release(sid, keep_empty=False)
+                if room_id:
+                    rooms.add(room_id)
+            self._forget_boot(boot)
+        return rooms
+
+    # One process holds every socket of a MemoryPartyStore: nothing to reap
+    def _touch(self):
+        pass
+
+    def _dead_boots(self):
+        return []
+
+
+class _MemoryTxn:
+    def __init__(self, rooms, touched, room_id):
+        self.rooms = rooms
+        self.touched = touched
+        self.room_id = room_id
+
+    def load(self):
+        return self.rooms.get(self.room_id)
+
+    def save(self, data):
+        self.rooms[self.room_id] = data
+        self.touched[self.room_id] = time.time()
+
+    def delete(self):
+        self.rooms.pop(self.room_id, None)
+        self.touched.pop(self.room_id, None)
+
+
+class MemoryPartyStore(PartyStore):
+    """Process-local rooms: only for a single worker; kept across restarts only by a snapshot."""
+
+    def __init__(self, room_ttl=ROOM_TTL):
+        super().__init__()
+        self.room_ttl = room_ttl
+        self._rooms = {}
+        self._touched = {}  # room -> wall-clock time it was last saved
+        self._sids = {}
+        self._lock = threading.RLock()
+
+    @contextmanager
+    def _begin(self, room_id):
+        with self._lock:
+            yield _MemoryTxn(self._rooms, self._touched, room_id)
+
+    def get(self, room_id):
+        return self._rooms.get(room_id)
+
+    def room_of(self, sid):
+        return self._sids.get(sid)
+
+    def _bind(self, sid, room_id):
+        self._sids[sid] = room_id
+
+    def _unbind(self, sid):
+        return self._sids.pop(sid, None)
+
+    def dump_rooms(self):
+        """{room: [data, last saved]} without the sockets, for a snapshot."""
+        with self._lock:
+            return json.loads(json.dumps({room_id: [{**data, 'host': None, 'users': {}}, self._touched.get(room_id, 0)]
+                                          for room_id, data in self._rooms.items()}))
+
+    def restore_rooms(self, rooms):
+        """Puts back dump_rooms() output; whoever rejoins first becomes host."""
+        cutoff = time.time() - self.room_ttl
+        with self._lock:
+            for room_id, (data, touched) in rooms.items():
+                if touched >= cutoff and room_id not in self._rooms:
+                    self._rooms[room_id] = data
+                    self._touched[room_id] = touched
+
+
+class _JsonTxn:
+    """Shared by the SQLite and Redis stores: skips the write when nothing changed."""
+
+    def __init__(self, raw, write, remove):
+        self.raw = raw
+        self._write = write
+        self._remove = remove
+
+    def load(self):
+        return json.loads(self.raw) if self.raw else None
+
+    def save(self, data):
+        raw = json.dumps(data)
+        if raw != self.raw:
+            self._write(raw)
+
+    def delete(self):
+        if self.raw:
+            self._remove()
+
+
+class SqlitePartyStore(PartyStore):
+    """Rooms in a SQLite file, shared by every worker on the host and kept across restarts."""
+
+    def __init__(self, db=None, room_ttl=ROOM_TTL, boot_ttl=BOOT_TTL):
+        super().__init__(boot_ttl)
+        self.db = db or Database(PARTY_DB)
+        self.room_ttl = room_ttl
+        with self.db.transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS party_rooms (room TEXT PRIMARY KEY, data TEXT, updated_at REAL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS party_sids (sid TEXT PRIMARY KEY, room TEXT, boot TEXT)")
+            if 'boot' not in [row[1] for row in conn.execute("PRAGMA table_info(party_sids)")]:
+                conn.execute("ALTER TABLE party_sids ADD COLUMN boot TEXT")
+            conn.execute("CREATE TABLE IF NOT EXISTS party_boots (boot TEXT PRIMARY KEY, seen_at REAL)")
+            conn.execute("DELETE FROM party_rooms WHERE updated_at < ?", (time.time() - self.room_ttl,))
+        self.reap()
+
+    @contextmanager
+    def _begin(self, room_id):
+        with self.db.transaction() as conn:
+            row = conn.execute("SELECT data FROM party_rooms WHERE room = ?", (room_id,)).fetchone()
+            yield _JsonTxn(
+                row[0] if row else None,
+                lambda raw: conn.execute('''INSERT INTO party_rooms (room, data, updated_at) VALUES (?, ?, ?)
+                                            ON CONFLICT(room) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at''',
+                                         (room_id, raw, time.time())),
+                lambda: conn.execute("DELETE FROM party_rooms WHERE room = ?", (room_id,)),
+            )
+
+    def get(self, room_id):
+        rows = self.db.execute("SELECT data FROM party_rooms WHERE room = ?", (room_id,))
+        return json.loads(rows[0][0]) if rows else None
+
+    def room_of(self, sid):
+        rows = self.db.execute("SELECT room FROM party_sids WHERE sid = ?", (sid,))
+        return rows[0][0] if rows else None
+
+    def _bind(self, sid, room_id):
+        self.db.execute("INSERT OR REPLACE INTO party_sids (sid, room, boot) VALUES (?, ?, ?)", (sid, room_id, self.boot))
+
+    def _unbind(self, sid):
+        with self.db.transaction() as conn:
+            row = conn.execute("SELECT room FROM party_sids WHERE sid = ?", (sid,)).fetchone()
+            if row:
+                conn.execute("DELETE FROM party_sids WHERE sid = ?", (sid,))
+        return row[0] if row else None
+
+    def _touch(self):
+        self.db.execute("INSERT OR REPLACE INTO party_boots (boot, seen_at) VALUES (?, ?)", (self.boot, time.time()))
+
+    def _dead_boots(self):
+        # Bindings from before boot ids were recorded have none: nobody is left to release those either
+        alive = time.time() - self.boot_ttl
+        rows = self.db.execute('''SELECT DISTINCT boot FROM party_sids WHERE boot IS NULL
+                                  OR boot NOT IN (SELECT boot FROM party_boots WHERE seen_at >= ?)''', (alive,))
+        stale = self.db.execute("SELECT boot FROM party_boots WHERE seen_at < ?", (alive,))
+        return list({row[0] for row in rows + stale})
+
+    def _boot_sids(self, boot):
+        return [row[0] for row in self.db.execute("SELECT sid FROM party_sids WHERE boot IS ?", (boot,))]
+
+    def _forget_boot(self, boot):
+        self.db.execute("DELETE FROM party_boots WHERE boot IS ?", (boot,))
+
+
+class RedisPartyStore(PartyStore):
+    """Rooms in Redis, for workers spread over several hosts. Needs the `redis` package."""
+
+    def __init__(self, url, prefix='aura:party:', room_ttl=ROOM_TTL, boot_ttl=BOOT_TTL):
+        super().__init__(boot_ttl)
+        import redis
+        self.redis = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.room_ttl = room_ttl
+        self.reap()
+
+    @contextmanager
+    def _begin(self, room_id):
+        key = f"{self.prefix}room:{room_id}"
+        with self.redis.lock(f"{self.prefix}lock:{room_id}", timeout=10, blocking_timeout=10):
+            raw = self.redis.get(key)
+            yield _JsonTxn(
+                raw.decode() if raw else None,
+                lambda raw: self.redis.set(key, raw, ex=self.room_ttl),
+                lambda: self.redis.delete(key),
+            )
+
+    def get(self, room_id):
+        raw = self.redis.get(f"{self.prefix}room:{room_id}")
+        return json.loads(raw) if raw else None
+
+    def room_of(self, sid):
+        room_id = self.redis.hget(f"{self.prefix}sids", sid)
+        return room_id.decode() if room_id else None
+
+    def _bind(self, sid, room_id):
+        pipe = self.redis.pipeline()
+        pipe.hset(f"{self.prefix}sids", sid, room_id)
+        pipe.hset(f"{self.prefix}sid_boots", sid, self.boot)
+        pipe.sadd(f"{self.prefix}boot:{self.boot}", sid)
+        pipe.execute()
+
+    def _unbind(self, sid):
+        # The socket may have been bound by another process (reap releases those)
+        pipe = self.redis.pipeline()
+        pipe.hget(f"{self.prefix}sids", sid)
+        pipe.hdel(f"{self.prefix}sids", sid)
+        pipe.hget(f"{self.prefix}sid_boots", sid)
+        pipe.hdel(f"{self.prefix}sid_boots", sid)
+        room_id, _, boot, _ = pipe.execute()
+        if boot:
+            self.redis.srem(f"{self.prefix}boot:{boot.decode()}", sid)
+        return room_id.decode() if room_id else None
+
+    def _touch(self):
+        pipe = self.redis.pipeline()
+        pipe.set(f"{self.prefix}alive:{self.boot}", 1, ex=self.boot_ttl)
+        pipe.sadd(f"{self.prefix}boots", self.boot)
+        pipe.execute()
+
+    def _dead_boots(self):
+        boots = [boot.decode() for boot in self.redis.smembers(f"{self.prefix}boots")]
+        pipe = self.redis.pipeline()
+        for boot in boots:
+            pipe.exists(f"{self.prefix}alive:{boot}")
+        return [boot for boot, alive in zip(boots, pipe.execute()) if not alive]
+
+    def _boot_sids(self, boot):
+        return [sid.decode() for sid in self.redis.smembers(f"{self.prefix}boot:{boot}")]
+
+    def _forget_boot(self, boot):
+        pipe = self.redis.pipeline()
+        pipe.delete(f"{self.prefix}boot:{boot}")
+        pipe.srem(f"{self.prefix}boots", boot)
+        pipe.execute()
+
+
+def make_party_store(url):
+    """'memory', 'sqlite' (or 'sqlite:///path/to.db') or a redis:// URL."""
+    if url == 'memory':
+        return MemoryPartyStore()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisPartyStore(url)
+    if url.startswith('sqlite:///'):
+        return SqlitePartyStore(Database(url[len('sqlite:///'):]))
+    if url == 'sqlite':
+        return SqlitePartyStore()
+    raise ValueError(f"Unknown party store: {url}")
@@ -0,0 +1,40 @@
+from ytmusicapi.continuations import CONTINUATION_ITEMS, get_continuation_token
+from ytmusicapi.navigation import (CONTENT, EDITABLE_PLAYLIST_DETAIL_HEADER, HEADER, RESPONSIVE_HEADER, SECTION,
+                                   SECTION_LIST_ITEM, TAB_CONTENT, TWO_COLUMN_RENDERER, nav)
+from ytmusicapi.parsers.playlists import parse_playlist_items
+
+
+def _playlist_title(response):
+    header_data = nav(response, [*TWO_COLUMN_RENDERER, *TAB_CONTENT, *SECTION_LIST_ITEM], True) or {}
+    if EDITABLE_PLAYLIST_DETAIL_HEADER[0] in header_data:
+        header = nav(header_data, [*EDITABLE_PLAYLIST_DETAIL_HEADER, *HEADER, *RESPONSIVE_HEADER], True) or {}
+    else:
+        header = nav(header_data, RESPONSIVE_HEADER, True) or {}
+    return ''.join(run['text'] for run in header.get('title', {}).get('runs', [])) or None
+
+
+def iter_playlist_pages(send, playlist_id, cursor=None):
+    """Yields (title, raw_tracks, next_cursor) for each upstream page of a playlist.
+
+    `send(body)` posts a YouTube Music browse request. This mirrors what
+    YTMusic.get_playlist does internally, but hands each page over as soon as it
+    arrives instead of collecting the whole playlist. Passing a cursor from an
+    earlier page resumes right after it (the title is only known on the first page).
+    """
+    token = cursor
+    if not token:
+        browse_id = playlist_id if playlist_id.startswith('VL') else 'VL' + playlist_id
+        response = send({'browseId': browse_id})
+        section_list = nav(response, [*TWO_COLUMN_RENDERER, 'secondaryContents', *SECTION], True) or {}
+        content_data = nav(section_list, [*CONTENT, 'musicPlaylistShelfRenderer'], True) or {}
+        contents = content_data.get('contents') or []
+        token = get_continuation_token(contents) if contents else None
+        yield _playlist_title(response), parse_playlist_items(contents) if contents else [], token
+
+    while token:
+        response = send({'continuation': token})
+        contents = nav(response, CONTINUATION_ITEMS, True)
+        if not contents:
+            return
+        token = get_continuation_token(contents)
+        yield None, parse_playlist_items(contents), token
@@ -0,0 +1,122 @@
+import threading
+import time
+from collections import OrderedDict
+
+from background import spawn_thread
+
+
+class Prefetcher:
+    """Warms caches in the background for lookups that are likely to come soon.
+
+    A task is a (kind, key) pair run as `fetchers[kind](key, payload)`. Each
+    owner (a party room, a recommendation answer) has one current list of
+    wanted tasks: scheduling a new list replaces the old one, and tasks no
+    owner wants any more are dropped before they start. The latest schedule
+    runs first. A task wanted by several owners runs once, a task finished in
+    the last `remember` seconds isn't repeated, and at most `max_pending` tasks
+    wait at a time; `workers` run concurrently.
+    """
+
+    def __init__(self, fetchers, workers=2, max_pending=256, remember=600, spawn=None):
+        self.fetchers = fetchers
+        self.workers = workers
+        self.max_pending = max_pending
+        self.remember = remember
+        self._spawn = spawn or spawn_thread
+        self._pending = OrderedDict()  # task -> payload, next to run first
+        self._wanted = {}  # pending task -> owners
+        self._owners = {}  # owner -> its pending tasks
+        self._in_flight = set()
+        self._done = OrderedDict()  # task -> monotonic time it finished
+        self._running = 0
+        self._lock = threading.Lock()
+        self.scheduled = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.dropped = 0
+
+    def schedule(self, owner, tasks):
+        """Replaces what `owner` wants with `tasks`, [(kind, key, payload)] most urgent first."""
+        now = time.monotonic()
+        tasks = OrderedDict(((kind, key), payload) for kind, key, payload in tasks if kind in self.fetchers and key)
+        with self._lock:
+            for task in self._owners.pop(owner, ()):
+                if task in tasks:
+                    continue
+                owners = self._wanted[task]
+                owners.discard(owner)
+                if not owners:
+                    del self._wanted[task]
+                    del self._pending[task]
+                    self.cancelled += 1
+
+            wanted = []
+            for task, payload in tasks.items():
+                if task in self._in_flight:
+                    continue
+                finished = self._done.get(task)
+                if finished is not None and now - finished < self.remember:
+                    continue
+                if task not in self._pending:
+                    if len(self._pending) >= self.max_pending:
+                        self.dropped += 1
+                        continue
+                    self._pending[task] = payload
+                    self.scheduled += 1
+                wanted.append(task)
+                self._wanted.setdefault(task, set()).add(owner)
+            # Front of the line, keeping this schedule's own order
+            for task in reversed(wanted):
+                self._pending.move_to_end(task, last=False)
+            if wanted:
+                self._owners[owner] = set(wanted)
+
+            start = max(0, min(self.workers - self._running, len(self._pending)))
+            self._running += start
+        for _ in range(start):
+            self._spawn(self._work)
+
+    def cancel(self, owner):
+        self.schedule(owner, [])
+
+    def _work(self):
+        while True:
+            with self._lock:
+                if not self._pending:
+                    self._running -= 1
+                    return
+                task, payload = self._pending.popitem(last=False)
+                for owner in self._wanted.pop(task, ()):
+                    owned = self._owners.get(owner)
+                    if owned is not None:
+                        owned.discard(task)
+                        if not owned:
+                            del self._owners[owner]
+                self._in_flight.add(task)
+            try:
+                self.fetchers[task[0]](task[1], payload)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                print(f"Prefetch Error ({task[0]} {task[1]}): {e}")
+            finally:
+                with self._lock:
+                    self._in_flight.discard(task)
+                    self._done[task] = time.monotonic()
+                    self._done.move_to_end(task)
+                    while len(self._done) > self.max_pending * 16:
+                        self._done.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pending': len(self._pending),
+                'in_flight': len(self._in_flight),
+                'owners': len(self._owners),
+                'scheduled': self.scheduled,
+                'completed': self.completed,
+                'failed': self.failed,
+                'cancelled': self.cancelled,
+                'dropped': self.dropped,
+            }
@@ -0,0 +1,78 @@
+import random
+
+from upstream import bounded_map
+
+TRENDING_QUERIES = ['Top Global Hits', 'New Music', 'Trending Songs', 'Viral Hits']
+
+
+class Recommender:
+    """Builds /recommend results from cached per-seed watch-lists.
+
+    Several history seeds are blended with reciprocal-rank fusion, so tracks
+    that show up on more than one seed's watch-list float to the top. The
+    no-history answer comes from trending pools that a background job keeps
+    warm, since every listener without history gets the same four answers.
+    """
+
+    def __init__(self, fetch_watch_list, fetch_trending, watch_cache, executor,
+                 max_seeds=3, limit=20, refresh_interval=1800):
+        self.fetch_watch_list = fetch_watch_list  # seed_id -> formatted tracks
+        self.fetch_trending = fetch_trending  # query -> formatted tracks
+        self.watch_cache = watch_cache
+        self.executor = executor
+        self.max_seeds = max_seeds
+        self.limit = limit
+        self.refresh_interval = refresh_interval
+        self.trending = {}
+
+    def refresh_trending(self):
+        for query in TRENDING_QUERIES:
+            try:
+                self.trending[query] = self.fetch_trending(query)
+            except Exception as e:
+                print(f"Trending Refresh Error ({query}): {e}")
+
+    def run_trending_scheduler(self, sleep):
+        # Pools restored at startup are served until the regular refresh
+        if any(self.trending.values()):
+            sleep(self.refresh_interval)
+        while True:
+            self.refresh_trending()
+            sleep(self.refresh_interval)
+
+    def trending_tracks(self):
+        pools = [pool for pool in self.trending.values() if pool]
+        if pools:
+            return random.choice(pools)
+        # Scheduler hasn't filled the pools yet (or upstream was down): fetch one live
+        query = random.choice(TRENDING_QUERIES)
+        self.trending[query] = self.fetch_trending(query)
+        return self.trending[query]
+
+    def watch_list(self, seed_id):
+        return self.watch_cache.get_or_load(seed_id, lambda: self.fetch_watch_list(seed_id))
+
+    def recommend(self, history, exclude=()):
+        history = [h for h in dict.fromkeys(history) if h]
+        if not history:
+            return self.trending_tracks()
+
+        seeds = random.sample(history, min(self.max_seeds, len(history)))
+        watch_lists = [
+            result for result in bounded_map(self.executor, self.watch_list, seeds, self.max_seeds)
+            if not isinstance(result, Exception)
+        ]
+        if not watch_lists:
+            return self.trending_tracks()
+
+        played = set(history) | set(exclude)
+        scores = {}
+        tracks = {}
+        for watch_list in watch_lists:
+            for rank, track in enumerate(watch_list):
+                if track['id'] in played:
+                    continue
+                scores[track['id']] = scores.get(track['id'], 0) + 1.0 / (10 + rank)
+                tracks.setdefault(track['id'], track)
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        return [tracks[track_id] for track_id in ranked[:self.limit]]
@@ -1,46 +1,220 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, g, request, jsonify
 import requests
 import os
 from urllib.parse import urlparse, parse_qs
-import random
 from ytmusicapi import YTMusic
+from ytmusicapi.exceptions import YTMusicServerError
 from flask_cors import CORS
-import sqlite3
+import functools
 import json
-from google.oauth2 import id_token
-from google.auth.transport import requests as google_requests
 from flask_socketio import SocketIO, emit, join_room, leave_room
+import threading
+import time
 import traceback
+import math
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout, wait as wait_futures
+from cache import TTLCache
+from cache_store import CACHE_DB, LyricsStore, ThumbnailStore
+from catalog import TrackCatalog
+from lyrics_resolver import LyricsResolver
+from metrics import CONTENT_TYPE, REGISTRY, Counter, Gauge, Histogram
+import party_state
+from party_store import MemoryPartyStore, make_party_store
+from playlist_import import iter_playlist_pages
+from prefetch import Prefetcher
+from recommender import Recommender
+from snapshot import Snapshots, exit_on_sigterm
+from static_assets import StaticAssets
+from storage import Database
+from throttle import Coalescer, RateLimiter
+from token_verifier import GOOGLE_CERTS_URL, TokenVerifier, parse_max_age
+from upstream import Gateway, bounded_map, deadline, pooled_session, submit_with_deadline
+from user_store import USERS_DB, InvalidPatch, SyncConflict, UserStore
 
-app = Flask(__name__, static_url_path='', static_folder='.')
+# Static files are served by static_file() below, from memory
+app = Flask(__name__, static_folder=None)
 CORS(app) 
-socketio = SocketIO(app, cors_allowed_origins="*", ping_timeout=60, ping_interval=25)
-yt = YTMusic(auth=None)
-yt.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+# With more than one worker, point SOCKETIO_MESSAGE_QUEUE at a broker (e.g. redis://...)
+# so a broadcast reaches sockets held by every worker. Clients connect over websocket
+# only, so no sticky sessions are needed.
+socketio = SocketIO(app, cors_allowed_origins="*", ping_timeout=60, ping_interval=25,
+                    message_queue=os.environ.get('SOCKETIO_MESSAGE_QUEUE'))
+WEB_CONCURRENCY = int(os.environ.get('WEB_CONCURRENCY', 1))
+if WEB_CONCURRENCY > 1 and not os.environ.get('SOCKETIO_MESSAGE_QUEUE'):
+    print("WARNING: several workers without SOCKETIO_MESSAGE_QUEUE, party broadcasts won't reach other workers")
+
+# Metrics, served in Prometheus text format on /metrics. Gauges are read when scraped.
+REQUEST_LATENCY = Histogram('aura_http_request_duration_seconds',
+                            'Time until the response starts (streamed bodies continue after), by route',
+                            ['route', 'method', 'status'])
+UPSTREAM_LATENCY = Histogram('aura_upstream_call_duration_seconds', 'Calls that went out to an upstream',
+                             ['upstream', 'call', 'outcome'])
+SOCKET_EVENTS = Counter('aura_socketio_events_total', 'Socket.IO events received', ['event'])
+PARTY_FANOUT = Histogram('aura_party_fanout_members', 'Members a party room broadcast goes to', ['event'],
+                         buckets=(1, 2, 5, 10, 25, 50, 100, 250))
+Gauge('aura_party_sockets', 'Party sockets held by this worker', fn=lambda: len(party_store.local_bindings()))
+Gauge('aura_party_rooms', 'Party rooms with members on this worker',
+      fn=lambda: len({room for _, room in party_store.local_bindings()}))
+Gauge('aura_upstream_degraded', '1 while the upstream circuit breaker is not closed', ['upstream'],
+      fn=lambda: {name: int(name in gateway.degraded()) for name in gateway.upstreams})
+Gauge('aura_cache_entries', 'Entries in in-process caches', ['cache'],
+      fn=lambda: {'search': len(search_cache), 'watch_lists': len(recommender.watch_cache)})
+
+def observe_upstream(name, key, seconds, outcome):
+    # Gateway keys are (upstream, call key); the call key starts with the method or path
+    call = key[1][0] if isinstance(key[1], tuple) else key[1]
+    UPSTREAM_LATENCY.observe(seconds, upstream=name, call=call, outcome=outcome)
+
+# Upstream gateway: every outbound call goes through here so it gets a keep-alive
+# pooled session, a deadline, a circuit breaker and single-flight coalescing.
+YT_TIMEOUT = float(os.environ.get('YT_TIMEOUT', 10))
+LRCLIB_TIMEOUT = float(os.environ.get('LRCLIB_TIMEOUT', 3))
+gateway = Gateway(observe=observe_upstream)
+gateway.register('youtube', YT_TIMEOUT, failure_exceptions=(requests.exceptions.RequestException, YTMusicServerError))
+gateway.register('lrclib', LRCLIB_TIMEOUT)
+lrclib_session = pooled_session(LRCLIB_TIMEOUT, headers={'User-Agent': 'AURA Music (https://github.com/kriSop41/AURA-music-player)'})
+gateway.register('google_certs', 5)
+google_session = pooled_session(5, pool_size=2)
+
+_yt = None
+_yt_lock = threading.Lock()
+
+def get_yt():
+    """The YTMusic client, built on first use so startup doesn't wait for it."""
+    global _yt
+    if _yt is None:
+        with _yt_lock:
+            if _yt is None:
+                client = YTMusic(auth=None, requests_session=pooled_session(YT_TIMEOUT, pool_size=20))
+                client.headers['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+                _yt = client
+    return _yt
+
+def yt_call(method, *args, **kwargs):
+    """Calls a YTMusic method through the gateway. Results may be shared, don't mutate them."""
+    key = (method, args, tuple(sorted(kwargs.items())))
+    # The client is built inside the call: building it fetches a visitor id from YouTube
+    return gateway.call('youtube', key, lambda: getattr(get_yt(), method)(*args, **kwargs))
+
+def lrclib_get(path, params):
+    """GETs an LRCLIB API path, returning the decoded JSON or None on 404."""
+    def fetch():
+        resp = lrclib_session.get(f"https://lrclib.net{path}", params=params)
+        if resp.status_code == 404: return None
+        resp.raise_for_status()
+        return resp.json()
+    return gateway.call('lrclib', (path, tuple(sorted(params.items()))), fetch)
+
+# Hot in-memory state (search answers, watch lists, trending pools, in-memory
+# party rooms) is written to a snapshot periodically and at exit, and each part
+# is restored as it's set up below, so a restart doesn't start from cold caches.
+# Lyrics, thumbnails and the catalog already live in SQLite.
+SNAPSHOT_MAX_ENTRIES = int(os.environ.get('SNAPSHOT_MAX_ENTRIES', 500))
+snapshots = Snapshots(os.environ.get('SNAPSHOT_PATH', 'aura_snapshot.json.gz'),
+                      max_age=int(os.environ.get('SNAPSHOT_MAX_AGE', 24 * 3600)))
+
+# Database Setup: WAL-mode files with pooled connections (see storage.py)
+users_db = Database(USERS_DB)
+cache_db = Database(CACHE_DB)
 
-# Database Setup
 def init_db():
-    with sqlite3.connect('aura_users.db') as conn:
-        c = conn.cursor()
-        c.execute('''CREATE TABLE IF NOT EXISTS users
-                     (google_id TEXT PRIMARY KEY, email TEXT, data TEXT)''')
-        conn.commit()
+    with users_db.transaction() as conn:
+        conn.execute('''CREATE TABLE IF NOT EXISTS users
+                        (google_id TEXT PRIMARY KEY, email TEXT, data TEXT)''')
 
 init_db()
+# Syncs are acknowledged immediately and committed in batches, merged per user.
+# Queued revisions are tracked per process, so several workers write through directly.
+user_store = UserStore(
+    users_db,
+    write_window=float(os.environ.get('USER_WRITE_WINDOW', 0.5 if WEB_CONCURRENCY == 1 else 0)),
+    spawn=socketio.start_background_task,
+    sleep=socketio.sleep,
+)
+
+# Search results are shared by everyone typing the same query, so keep a bounded
+# in-process copy and refresh stale entries in the background.
+search_cache = TTLCache(
+    'search',
+    ttl=int(os.environ.get('SEARCH_CACHE_TTL', 600)),
+    stale_ttl=int(os.environ.get('SEARCH_CACHE_STALE_TTL', 3600)),
+    max_entries=int(os.environ.get('SEARCH_CACHE_MAX_ENTRIES', 2000)),
+    max_bytes=int(os.environ.get('SEARCH_CACHE_MAX_BYTES', 32 * 1024 * 1024)),
+    spawn=socketio.start_background_task,
+)
+snapshots.register('search', lambda: search_cache.dump(SNAPSHOT_MAX_ENTRIES), search_cache.restore)
+
+# Resolved lyrics (and "not available" answers) persist across restarts in a sibling database
+lyrics_store = LyricsStore(cache_db)
+thumbnail_store = ThumbnailStore(cache_db, ttl=int(os.environ.get('ARTIST_THUMB_TTL', 14 * 86400)))
+
+# Every track seen in an upstream answer or a party queue, full-text indexed for
+# /suggest and for answering /search when YouTube is slow or down
+catalog = TrackCatalog(cache_db, max_tracks=int(os.environ.get('CATALOG_MAX_TRACKS', 200000)),
+                       spawn=socketio.start_background_task, sleep=socketio.sleep)
+# A search miss still waiting on YouTube after this many seconds is answered from the catalog
+SEARCH_CATALOG_AFTER = float(os.environ.get('SEARCH_CATALOG_AFTER', 1.5))
+
+# Shared pool for fanning out upstream calls (green threads under the eventlet worker)
+upstream_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('UPSTREAM_POOL_SIZE', 16)))
+ARTIST_FETCH_CONCURRENCY = int(os.environ.get('ARTIST_FETCH_CONCURRENCY', 6))
 
-# Security: Block access to source code and config files
 @app.route('/health')
 def health():
+    """OK/DEGRADED for load balancers (always 200: a YouTube outage isn't ours to restart);
+    ?detail=1 answers with each upstream's breaker state and counters as JSON."""
+    degraded = gateway.degraded()
+    if request.args.get('detail'):
+        return jsonify({'status': 'degraded' if degraded else 'ok', 'degraded': degraded, 'upstreams': gateway.stats()})
+    if degraded:
+        return f"DEGRADED: {', '.join(degraded)}", 200
     return "OK", 200
 
+@app.route('/metrics')
+def metrics():
+    return Response(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 @app.before_request
-def block_sensitive_files():
-    if request.path.endswith('.py') or request.path in ['/requirements.txt', '/Procfile', '/.env']:
-        return "Access Denied", 403
+def start_request_timer():
+    g.request_start = time.perf_counter()
 
+@app.after_request
+def record_request_latency(response):
+    start = g.pop('request_start', None)
+    if start is not None and request.url_rule is not None:
+        REQUEST_LATENCY.observe(time.perf_counter() - start, route=request.url_rule.rule,
+                                method=request.method, status=response.status_code)
+    return response
+
+# Frontend files: precompressed, with strong ETags, and content-hashed CSS/JS URLs that
+# can be cached forever (see static_assets.py). Only known asset types are loaded, so
+# sources, databases and config next to them are never served.
+static_assets = StaticAssets(os.path.dirname(os.path.abspath(__file__)))
+
+# Its own view: with defaults= on static_file, Flask would redirect /index.html to /
 @app.route('/')
 def index():
-    return send_from_directory('.', 'index.html')
+    return static_file('index.html')
+
+@app.route('/<path:filename>')
+def static_file(filename):
+    found = static_assets.get(filename)
+    if found is None:
+        return "Not Found", 404
+    asset, fingerprinted = found
+    coding = asset.negotiate(request.headers.get('Accept-Encoding'))
+    response = Response(content_type=asset.content_type)
+    response.set_etag(asset.etag(coding))
+    response.headers['Vary'] = 'Accept-Encoding'
+    # Hashed URLs never change content; everything else is revalidated (cheaply, with a 304)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable' if fingerprinted else 'no-cache'
+    if request.if_none_match.contains_weak(asset.etag(coding)):
+        response.status_code = 304
+        return response
+    response.set_data(asset.bodies[coding])
+    if coding:
+        response.headers['Content-Encoding'] = coding
+    return response
 
 @app.route('/search')
 def search():
@@ -51,55 +225,158 @@ def search():
         
         # Use 'songs' for official tracks, 'videos' for lyrics/fallbacks
         search_filter = "videos" if " lyrics" in query.lower() else "songs"
-        return jsonify(yt.search(query, filter=search_filter))
+        cache_key = (' '.join(query.lower().split()), search_filter)
+
+        def load():
+            results = yt_call('search', query, filter=search_filter)
+            catalog.add(_format_tracks(results))
+            return results
+
+        # Song searches that would have to wait on YouTube can be answered locally
+        use_catalog = search_filter == 'songs' and search_cache.get(cache_key) is None
+        if use_catalog and 'youtube' in gateway.degraded():
+            fallback = _catalog_search(query)
+            if fallback is not None:
+                return fallback
+        if use_catalog and SEARCH_CATALOG_AFTER > 0:
+            # The load carries on in the pool after a timeout and fills the cache for the next ask
+            future = submit_with_deadline(upstream_pool, search_cache.get_or_load, cache_key, load)
+            try:
+                return jsonify(future.result(timeout=SEARCH_CATALOG_AFTER))
+            except FutureTimeout:
+                fallback = _catalog_search(query)
+                return fallback if fallback is not None else jsonify(future.result())
+        return jsonify(search_cache.get_or_load(cache_key, load))
     except Exception as e:
         print(f"Search Error: {e}") # Check Render Logs for this
-        return jsonify({'error': str(e)}), 500
+        fallback = _catalog_search(query) if query and " lyrics" not in query.lower() else None
+        return fallback if fallback is not None else (jsonify({'error': str(e)}), 500)
+
+def _as_search_result(track):
+    # Catalog rows in the shape /search results have upstream, which is what the search box reads
+    minutes, seconds = divmod(track['duration'] or 0, 60)
+    return {
+        'videoId': track['id'],
+        'title': track['title'],
+        'artists': [{'name': track['artist'], 'id': track['artistId']}],
+        'thumbnails': [{'url': track['thumb']}] if track['thumb'] else [],
+        'duration': f"{minutes}:{seconds:02d}" if track['duration'] else None,
+        'resultType': 'song',
+    }
+
+def _catalog_search(query):
+    """Catalog matches as a /search response, or None when there are none."""
+    try:
+        tracks = catalog.search(query)
+    except Exception as e:
+        print(f"Catalog Search Error: {e}")
+        return None
+    if not tracks:
+        return None
+    response = jsonify([_as_search_result(t) for t in tracks])
+    response.headers['X-Search-Source'] = 'catalog'
+    return response
+
+@app.route('/suggest')
+def suggest():
+    """Search-as-you-type from the local catalog only, so it answers in a few milliseconds."""
+    query = request.args.get('q', '')
+    try:
+        limit = min(max(int(request.args.get('limit', 8)), 1), 20)
+    except ValueError:
+        limit = 8
+    response = jsonify([_as_search_result(t) for t in catalog.search(query, limit)])
+    response.headers['Cache-Control'] = 'public, max-age=60'
+    return response
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify({
+        'search': search_cache.stats(),
+        'watch_lists': recommender.watch_cache.stats(),
+        'upstreams': gateway.stats(),
+        'tokens': token_verifier.stats(),
+        'user_writes': user_store.writes.stats(),
+        'catalog': catalog.stats(),
+        'prefetch': prefetcher.stats(),
+        'static': static_assets.stats(),
+        'snapshot': snapshots.stats(),
+        'party': {
+            'playback': playback_events.stats(),
+            'actions': action_limiter.stats(),
+            'chat': chat_limiter.stats(),
+            'typing': typing_limiter.stats(),
+        },
+    })
 
 @app.route('/lyrics')
 def lyrics():
     title = request.args.get('title')
     artist = request.args.get('artist')
-    
-    # Try fetching synced lyrics from LRCLIB (often sources from Musixmatch/Spotify)
-    if title and artist:
-        # Clean title: remove (Official Video), [Lyrics], etc. for better matching
-        clean_title = title.split('(')[0].split('[')[0].strip()
-        try:
-            resp = requests.get("https://lrclib.net/api/get", params={'artist_name': artist, 'track_name': clean_title})
-            data = resp.json()
-            if data.get('syncedLyrics'):
-                return jsonify({'lyrics': data['syncedLyrics'], 'synced': True})
-            if data.get('plainLyrics'):
-                return jsonify({'lyrics': data['plainLyrics'], 'synced': False})
-        except (requests.exceptions.RequestException, json.JSONDecodeError): pass
-
     video_id = request.args.get('id')
-    if not video_id: return jsonify({'lyrics': ''})
-    try:
-        watch_playlist = yt.get_watch_playlist(videoId=video_id)
-        lyrics_id = watch_playlist.get('lyrics')
-        if lyrics_id:
-            lyrics_data = yt.get_lyrics(lyrics_id)
-            return jsonify({'lyrics': lyrics_data['lyrics'], 'synced': False})
-    except Exception: pass
-
-    # Fallback: If direct ID failed, search for the official song on YT Music
-    if title and artist:
-        try:
-            search_results = yt.search(f"{title} {artist}", filter="songs")
-            if search_results:
-                official_id = search_results[0]['videoId']
-                if official_id != video_id:
-                    watch_playlist = yt.get_watch_playlist(videoId=official_id)
-                    lyrics_id = watch_playlist.get('lyrics')
-                    if lyrics_id:
-                        lyrics_data = yt.get_lyrics(lyrics_id)
-                        return jsonify({'lyrics': lyrics_data['lyrics'], 'synced': False})
-        except Exception: pass
 
+    cached = lyrics_store.get(video_id, title, artist)
+    if cached:
+        if cached['found']:
+            return jsonify({'lyrics': cached['lyrics'], 'synced': cached['synced']})
+        return jsonify({'lyrics': 'Lyrics not available.'})
+
+    result = _resolve_lyrics(title, artist, video_id)
+    if result is None and not video_id:
+        return jsonify({'lyrics': ''})
+    if result:
+        return jsonify(result)
     return jsonify({'lyrics': 'Lyrics not available.'})
 
+def _resolve_lyrics(title, artist, video_id):
+    """Asks the lyrics sources and stores the answer; returns the result or None."""
+    result, source, complete = lyrics_resolver.resolve(title, artist, video_id)
+    # An answer is only stored under the key that produced it: title, artist and id
+    # all come from the client, so lyrics found by title must not land on the id
+    if source == 'yt':
+        lyrics_store.put(result, video_id=video_id)
+    elif result:
+        lyrics_store.put(result, title=title, artist=artist)
+    elif complete and video_id:
+        # Don't remember a miss if a source errored or timed out, it may just be a blip,
+        # and a title-only miss isn't worth keeping either
+        lyrics_store.put(None, video_id, title, artist)
+    return result
+
+def _lrclib_lyrics(title, artist):
+    """Synced lyrics from LRCLIB (often sources from Musixmatch/Spotify)."""
+    # Clean title: remove (Official Video), [Lyrics], etc. for better matching
+    clean_title = title.split('(')[0].split('[')[0].strip()
+    data = lrclib_get('/api/get', {'artist_name': artist, 'track_name': clean_title})
+    if not data: return None
+    if data.get('syncedLyrics'):
+        return {'lyrics': data['syncedLyrics'], 'synced': True}
+    if data.get('plainLyrics'):
+        return {'lyrics': data['plainLyrics'], 'synced': False}
+    return None
+
+def _yt_lyrics(video_id):
+    watch_playlist = yt_call('get_watch_playlist', videoId=video_id)
+    lyrics_id = watch_playlist.get('lyrics')
+    if not lyrics_id: return None
+    lyrics_data = yt_call('get_lyrics', lyrics_id)
+    return {'lyrics': lyrics_data['lyrics'], 'synced': False}
+
+def _official_video_id(title, artist):
+    """Fallback: search for the official song on YT Music when the direct ID has no lyrics."""
+    search_results = yt_call('search', f"{title} {artist}", filter="songs")
+    return search_results[0]['videoId'] if search_results else None
+
+# Sources are raced, but an answer is only used once every preferred source has settled:
+# LRCLIB (synced, then plain) > YT lyrics for the video id > YT lyrics for the searched official song
+lyrics_resolver = LyricsResolver(
+    _lrclib_lyrics, _yt_lyrics, _official_video_id,
+    executor=upstream_pool,
+    lrclib_timeout=LRCLIB_TIMEOUT,
+    yt_timeout=float(os.environ.get('YT_LYRICS_TIMEOUT', 5)),
+    fallback_timeout=float(os.environ.get('YT_LYRICS_FALLBACK_TIMEOUT', 6)),
+)
+
 def parse_duration_from_string(duration_str):
     if not duration_str: return 0
     parts = duration_str.split(':')
@@ -133,6 +410,13 @@ def _format_track(track):
         'duration': parse_duration_from_string(track.get('duration'))
     }
 
+def _format_tracks(raw_tracks):
+    # Process tracks into a consistent format for the frontend
+    return [
+        formatted_track for track in raw_tracks
+        if (formatted_track := _format_track(track)) is not None
+    ]
+
 @app.route('/import_playlist', methods=['POST'])
 def import_playlist():
     try:
@@ -147,12 +431,14 @@ def import_playlist():
             if 'list' in query_params:
                 playlist_id = query_params['list'][0]
         
+        if playlist_id and (data.get('stream') or request.args.get('stream')):
+            return Response(_stream_playlist(playlist_id, data.get('cursor')), mimetype='application/x-ndjson',
+                            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
         if playlist_id:
-            playlist = yt.get_playlist(playlist_id, limit=200)
-            tracks = [
-                formatted_track for track in playlist.get('tracks', [])
-                if (formatted_track := _format_track(track)) is not None
-            ]
+            playlist = yt_call('get_playlist', playlist_id, limit=200)
+            tracks = _format_tracks(playlist.get('tracks', []))
+            catalog.add(tracks)
             return jsonify({'title': playlist.get('title', 'Imported Playlist'), 'tracks': tracks})
 
         return jsonify({'error': 'Invalid or unsupported YouTube playlist URL'}), 400
@@ -160,57 +446,208 @@ def import_playlist():
         print(f"Import Error: {e}")
         return jsonify({'error': str(e)}), 500
 
+def _stream_playlist(playlist_id, cursor=None):
+    """NDJSON import: a 'meta' line, one 'tracks' line per upstream page, then 'done'.
+
+    Every 'tracks' line carries the cursor of the next page. If the import breaks
+    off, an 'error' line repeats the last cursor so the client can resume from it.
+    """
+    def send(body):
+        # YTMusic has no public per-page API, so page through its browse endpoint directly
+        key = ('browse', playlist_id, body.get('continuation'))
+        return gateway.call('youtube', key, lambda: get_yt()._send_request('browse', body))
+
+    count = 0
+    try:
+        pages = iter_playlist_pages(send, playlist_id, cursor)
+        for index, (title, raw_tracks, next_cursor) in enumerate(pages):
+            if index == 0 and not cursor:
+                yield json.dumps({'type': 'meta', 'title': title or 'Imported Playlist'}) + '\n'
+            tracks = _format_tracks(raw_tracks)
+            catalog.add(tracks)
+            count += len(tracks)
+            cursor = next_cursor
+            yield json.dumps({'type': 'tracks', 'tracks': tracks, 'cursor': next_cursor}) + '\n'
+        yield json.dumps({'type': 'done', 'count': count}) + '\n'
+    except Exception as e:
+        print(f"Import Stream Error: {e}")
+        yield json.dumps({'type': 'error', 'error': str(e), 'cursor': cursor}) + '\n'
+
+def _fetch_watch_list(seed_id):
+    # Use a song from history as a seed for YouTube's ML recommendation engine
+    watch_list = yt_call('get_watch_playlist', videoId=seed_id, limit=20)
+    tracks = _format_tracks(watch_list.get('tracks', []))
+    catalog.add(tracks)
+    return tracks
+
+def _fetch_trending(query):
+    # Fallback to trending/top hits if no history (Random/Initial state)
+    tracks = _format_tracks(yt_call('search', query, filter='songs', limit=20))
+    catalog.add(tracks)
+    return tracks
+
+recommender = Recommender(
+    _fetch_watch_list, _fetch_trending,
+    watch_cache=TTLCache(
+        'watch_lists',
+        ttl=int(os.environ.get('WATCH_LIST_TTL', 1800)),
+        stale_ttl=int(os.environ.get('WATCH_LIST_STALE_TTL', 6 * 3600)),
+        max_entries=int(os.environ.get('WATCH_LIST_MAX_ENTRIES', 5000)),
+        spawn=socketio.start_background_task,
+    ),
+    executor=upstream_pool,
+    refresh_interval=int(os.environ.get('TRENDING_REFRESH_INTERVAL', 1800)),
+)
+snapshots.register('watch_lists', lambda: recommender.watch_cache.dump(SNAPSHOT_MAX_ENTRIES), recommender.watch_cache.restore)
+snapshots.register('trending', lambda: recommender.trending, recommender.trending.update)
+socketio.start_background_task(recommender.run_trending_scheduler, socketio.sleep)
+
 @app.route('/recommend', methods=['POST'])
 def recommend():
     try:
         data = request.get_json() or {}
         history = data.get('history', []) # Expecting a list of videoIds
-        
-        raw_tracks = []
-        if history and len(history) > 0:
-            # Use a random song from history as a seed for YouTube's ML recommendation engine
-            seed_id = random.choice(history)
-            watch_list = yt.get_watch_playlist(videoId=seed_id, limit=20)
-            raw_tracks = watch_list.get('tracks', [])
-        else:
-            # Fallback to trending/top hits if no history (Random/Initial state)
-            queries = ['Top Global Hits', 'New Music', 'Trending Songs', 'Viral Hits']
-            raw_tracks = yt.search(random.choice(queries), filter='songs', limit=20)
-
-        # Process tracks into a consistent format for the frontend
-        processed_tracks = [
-            formatted_track for track in raw_tracks
-            if (formatted_track := _format_track(track)) is not None
-        ]
-            
-        return jsonify(processed_tracks)
+        tracks = recommender.recommend(history, exclude=data.get('exclude', []))
+        # The first picks are what autoplay plays next
+        prefetch_tracks(f"recommend:{str(history)[:200]}", tracks)
+        return jsonify(tracks)
     except Exception as e:
         print(f"Recommend Error: {e}")
         return jsonify({'error': str(e)}), 500
 
+def _fetch_artist_thumbnail(artist_id):
+    # There's no lighter endpoint for this, so the thumbnail is cached for a long time instead
+    artist_details = yt_call('get_artist', artist_id)
+    return artist_details['thumbnails'][-1]['url'] if artist_details.get('thumbnails') else ''
+
 @app.route('/get_artist_thumbnails', methods=['POST'])
 def get_artist_thumbnails():
     try:
-        artists_req = request.get_json() or []
-        artists_with_thumbs = []
-        for artist_data in artists_req:
-            try:
-                artist_id = artist_data.get('id')
-                if not artist_id: continue
-                artist_details = yt.get_artist(artist_id)
-                artists_with_thumbs.append({
-                    'name': artist_data.get('name'),
-                    'browseId': artist_id,
-                    'thumbnail': artist_details['thumbnails'][-1]['url'] if artist_details.get('thumbnails') else ''
-                })
-            except Exception as e:
-                print(f"Could not fetch artist {artist_id}: {e}")
-                continue # Skip if artist can't be fetched, log the error
+        artists_req = [a for a in (request.get_json() or []) if a.get('id')]
+        thumbnails = thumbnail_store.get_many([a['id'] for a in artists_req])
+
+        missing = list(dict.fromkeys(a['id'] for a in artists_req if a['id'] not in thumbnails))
+        if missing:
+            fetched = {}
+            results = bounded_map(upstream_pool, _fetch_artist_thumbnail, missing, ARTIST_FETCH_CONCURRENCY)
+            for artist_id, result in zip(missing, results):
+                if isinstance(result, Exception):
+                    print(f"Could not fetch artist {artist_id}: {result}")
+                    continue # Skip if artist can't be fetched, log the error
+                fetched[artist_id] = result
+            thumbnail_store.put_many(fetched)
+            thumbnails.update(fetched)
+
+        artists_with_thumbs = [
+            {'name': a.get('name'), 'browseId': a['id'], 'thumbnail': thumbnails[a['id']]}
+            for a in artists_req if a['id'] in thumbnails
+        ]
         return jsonify(artists_with_thumbs)
     except Exception as e:
         print(f"Get Artist Thumbnails Error: {e}")
         return jsonify({'error': str(e)}), 500
 
+# Prefetch: lyrics and artist art for the next few tracks of a party queue or a
+# recommendation are looked up in the background, so they're cached by the time they play
+def _prefetch_lyrics(video_id, song):
+    title, artist = song
+    if lyrics_store.get(video_id, title, artist) is None:
+        _resolve_lyrics(title, artist, video_id)
+
+def _prefetch_artist(artist_id, _):
+    if not thumbnail_store.get_many([artist_id]):
+        thumbnail_store.put_many({artist_id: _fetch_artist_thumbnail(artist_id)})
+
+PREFETCH_AHEAD = int(os.environ.get('PREFETCH_AHEAD', 3))
+prefetcher = Prefetcher(
+    {'lyrics': _prefetch_lyrics, 'artist': _prefetch_artist},
+    workers=int(os.environ.get('PREFETCH_WORKERS', 2)),
+    max_pending=int(os.environ.get('PREFETCH_MAX_PENDING', 256)),
+    spawn=socketio.start_background_task,
+)
+
+def prefetch_tracks(owner, songs):
+    """Replaces what's prefetched for `owner` with the first PREFETCH_AHEAD of `songs`."""
+    tasks = []
+    for song in songs[:PREFETCH_AHEAD]:
+        if not isinstance(song, dict) or not isinstance(song.get('id'), str):
+            continue
+        if isinstance(song.get('title'), str) and isinstance(song.get('artist'), str):
+            tasks.append(('lyrics', song['id'], (song['title'], song['artist'])))
+        if isinstance(song.get('artistId'), str):
+            tasks.append(('artist', song['artistId'], None))
+    prefetcher.schedule(owner, tasks)
+
+# /batch: several read-only calls in one round trip, e.g. everything a track change needs
+BATCH_ROUTES = {'/search', '/suggest', '/lyrics', '/recommend', '/get_artist_thumbnails'}
+BATCH_MAX_ITEMS = int(os.environ.get('BATCH_MAX_ITEMS', 10))
+BATCH_TIMEOUT = float(os.environ.get('BATCH_TIMEOUT', 8))
+# Separate from upstream_pool, which the handlers themselves fan out on
+batch_pool = ThreadPoolExecutor(max_workers=int(os.environ.get('BATCH_POOL_SIZE', 32)))
+
+def _run_sub_request(item, ends_at):
+    """Dispatches one /batch item through the regular handler, hooks included."""
+    with deadline(max(ends_at - time.monotonic(), 0.001)):
+        with app.test_request_context(item['path'], method=item.get('method', 'GET').upper(),
+                                      query_string=item.get('query'), json=item.get('body')):
+            response = app.full_dispatch_request()
+    body = response.get_json(silent=True)
+    return {'status': response.status_code, 'body': body if body is not None else response.get_data(as_text=True)}
+
+@app.route('/batch', methods=['POST'])
+def batch():
+    """Runs a list of sub-requests concurrently and answers with all their results.
+
+    Body: {"requests": [{"id", "path", "method"?, "query"?, "body"?}, ...], "timeout"?: seconds}.
+    Every item shares one deadline; items still running when it passes answer 504
+    (they finish in the background, so their caches still fill).
+    """
+    data = request.get_json(silent=True) or {}
+    items = data.get('requests')
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': 'requests must be a non-empty list'}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({'error': f"At most {BATCH_MAX_ITEMS} requests per batch"}), 400
+    try:
+        timeout = float(data.get('timeout', BATCH_TIMEOUT))
+    except (TypeError, ValueError):
+        timeout = BATCH_TIMEOUT
+    if not math.isfinite(timeout):
+        timeout = BATCH_TIMEOUT
+    timeout = min(max(timeout, 0.001), BATCH_TIMEOUT)
+    ends_at = time.monotonic() + timeout
+
+    results = [None] * len(items)
+    futures = {}
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or item.get('path') not in BATCH_ROUTES or \
+                str(item.get('method', 'GET')).upper() not in ('GET', 'POST'):
+            results[index] = {'status': 400, 'error': 'Unsupported sub-request'}
+        else:
+            futures[batch_pool.submit(_run_sub_request, item, ends_at)] = index
+
+    done, _ = wait_futures(futures, timeout=timeout)
+    for future, index in futures.items():
+        if future not in done:
+            results[index] = {'status': 504, 'error': 'Deadline exceeded'}
+        elif future.exception() is not None:
+            results[index] = {'status': 500, 'error': str(future.exception())}
+        else:
+            results[index] = future.result()
+    for item, result in zip(items, results):
+        result['id'] = item.get('id') if isinstance(item, dict) else None
+    return jsonify({'responses': results})
+
+def _fetch_google_certs():
+    def fetch():
+        resp = google_session.get(GOOGLE_CERTS_URL)
+        resp.raise_for_status()
+        return resp.json(), parse_max_age(resp.headers.get('Cache-Control'))
+    return gateway.call('google_certs', 'certs', fetch)
+
+# Verifies Google ID tokens against a cached cert set and remembers verified tokens until they expire
+token_verifier = TokenVerifier(_fetch_google_certs)
+
 @app.route('/api/auth/login', methods=['POST'])
 def google_login():
     try:
@@ -220,25 +657,18 @@ def google_login():
         if not token: return jsonify({'error': 'No token provided'}), 400
 
         # Verify the token
-        id_info = id_token.verify_oauth2_token(token, google_requests.Request(), client_id)
+        id_info = token_verifier.verify(token, client_id)
         user_id = id_info['sub']
         email = id_info.get('email')
 
-        with sqlite3.connect('aura_users.db') as conn:
-            c = conn.cursor()
-            c.execute("SELECT data FROM users WHERE google_id = ?", (user_id,))
-            row = c.fetchone()
-            
-            user_data = {}
-            if row and row[0]:
-                user_data = json.loads(row[0])
-            else:
-                # New user
-                c.execute("INSERT OR IGNORE INTO users (google_id, email, data) VALUES (?, ?, ?)", (user_id, email, '{}'))
-            
-        return jsonify({
+        user_data, rev = user_store.login(user_id, email)
+        if not any(user_data.values()):
+            user_data = {} # Nothing in the cloud yet, keep whatever the device has
+
+        response = jsonify({
             'status': 'success', 
             'data': user_data,
+            'rev': rev,
             'user_info': {
                 'id': user_id,
                 'name': id_info.get('name'),
@@ -246,6 +676,8 @@ def google_login():
                 'email': email
             }
         })
+        response.headers['ETag'] = f'"{rev}"'
+        return response
     except ValueError as e:
         print(f"Auth Error (Invalid Token): {e}")
         return jsonify({'error': 'Invalid or expired token'}), 401
@@ -255,22 +687,52 @@ def google_login():
 
 @app.route('/api/auth/sync', methods=['POST'])
 def sync_user_data():
+    """Delta sync. The client sends the revision it last saw plus a list of patches
+    (see UserStore); a full `data` object is still accepted from older clients.
+
+    An empty patch list at the current revision is answered without any write.
+    If another device synced in between, the answer is a 409 with the current
+    revision and library so the client can rebase its patches and retry.
+    """
     try:
         token = request.json.get('credential')
         client_id = request.json.get('clientId')
         data = request.json.get('data')
-        
-        if not token or not data: return jsonify({'error': 'Missing data'}), 400
+        patches = request.json.get('patches')
+        base_rev = request.json.get('rev')
+        if base_rev is None and request.headers.get('If-Match'):
+            try:
+                base_rev = int(request.headers['If-Match'].strip().strip('"'))
+            except ValueError:
+                return jsonify({'error': 'If-Match must be a revision number'}), 400
+
+        if not token or (not data and patches is None): return jsonify({'error': 'Missing data'}), 400
+        if patches is not None and not isinstance(patches, list): return jsonify({'error': 'patches must be a list'}), 400
 
         # Verify token again for security on write
-        id_info = id_token.verify_oauth2_token(token, google_requests.Request(), client_id)
+        id_info = token_verifier.verify(token, client_id)
         user_id = id_info['sub']
 
-        with sqlite3.connect('aura_users.db') as conn:
-            c = conn.cursor()
-            c.execute("UPDATE users SET data = ? WHERE google_id = ?", (json.dumps(data), user_id))
-            
-        return jsonify({'status': 'synced'})
+        if not data and not patches:
+            # Nothing changed on this device: just confirm the revision, no write
+            rev = user_store.revision(user_id)
+            if rev is None:
+                return jsonify({'error': 'Unknown user, log in first'}), 400
+            if base_rev is not None and base_rev != rev:
+                raise SyncConflict(rev)
+            response = jsonify({'status': 'unchanged', 'rev': rev})
+        else:
+            rev = user_store.write(user_id, base_rev, patches or (), data=data or None)
+            response = jsonify({'status': 'synced', 'rev': rev})
+        response.headers['ETag'] = f'"{rev}"'
+        return response
+    except SyncConflict:
+        current, rev = user_store.load(user_id)
+        response = jsonify({'error': 'conflict', 'rev': rev, 'data': current})
+        response.headers['ETag'] = f'"{rev}"'
+        return response, 409
+    except InvalidPatch as e:
+        return jsonify({'error': str(e)}), 400
     except ValueError as e:
         print(f"Sync Auth Error (Invalid Token): {e}")
         return jsonify({'error': 'Invalid or expired token'}), 401
@@ -279,27 +741,56 @@ def sync_user_data():
         return jsonify({'error': str(e)}), 500
 
 # Socket.IO Events for Listen Along
-# NOTE: This in-memory state will be lost on server restart.
-# For production, consider using a persistent store like Redis.
-party_rooms = {}
-sid_to_room = {}
+# Rooms live in party_store (see party_store.py) rather than in this process, so
+# every worker sees the same parties and a restarted server picks them back up.
+party_store = make_party_store(os.environ.get('PARTY_STORE', 'sqlite'))
+if isinstance(party_store, MemoryPartyStore):
+    snapshots.register('party_rooms', party_store.dump_rooms, party_store.restore_rooms)
 
-def emit_users(room):
-    if room in party_rooms:
+socketio.start_background_task(snapshots.run_scheduler, socketio.sleep, int(os.environ.get('SNAPSHOT_INTERVAL', 300)))
+exit_on_sigterm()
+
+def socket_event(name):
+    """socketio.on that also counts the event."""
+    def decorator(handler):
+        @functools.wraps(handler)
+        def counted(*args):
+            SOCKET_EVENTS.inc(event=name)
+            return handler(*args)
+        return socketio.on(name)(counted)
+    return decorator
+
+def party_emit(event, data, room, room_data=None):
+    """Broadcasts to a party room, recording the fan-out when the members are known."""
+    if room_data is not None:
+        PARTY_FANOUT.observe(len(room_data['users']), event=event)
+    socketio.emit(event, data, room=room)
+
+def emit_users(room, room_data=None):
+    if room_data is None:
+        room_data = party_store.get(room)
+    if room_data:
         users_list = []
-        host_sid = party_rooms[room]['host']
-        host_id = party_rooms[room]['users'].get(host_sid, {}).get('id')
+        host_sid = room_data['host']
+        host_id = room_data['users'].get(host_sid, {}).get('id')
         
-        for sid, u in party_rooms[room]['users'].items():
+        for sid, u in room_data['users'].items():
             users_list.append({
                 'id': u['id'],
                 'name': u['name'],
                 'avatar': u['avatar'],
                 'isHost': (sid == host_sid)
             })
-        socketio.emit('party_users', {'users': users_list, 'hostId': host_id}, room=room)
+        party_emit('party_users', {'users': users_list, 'hostId': host_id}, room, room_data)
 
-@socketio.on('join_party')
+def new_party_room(host_sid):
+    return {
+        'host': host_sid,
+        'users': {},
+        'state': party_state.new_state()
+    }
+
+@socket_event('join_party')
 def on_join(data):
     room = str(data['room']).strip().lower()
     print(f"Join Party: {room} | User: {data.get('username')} | PID: {os.getpid()}")
@@ -308,128 +799,166 @@ def on_join(data):
     avatar = data.get('avatar')
     
     join_room(room)
-    sid_to_room[request.sid] = room
-    
-    if room not in party_rooms:
+    party_store.bind(request.sid, room)
+
+    def create():
         # First user to join creates the party, becomes host, and defines the initial state
         print(f"Creating new party room: {room} on PID {os.getpid()}")
-        party_rooms[room] = {
-            'host': request.sid, 
-            'users': {},
-            'state': { 'song': None, 'isPlaying': False, 'time': 0, 'queue': [] }
+        return new_party_room(request.sid)
+
+    with party_store.room(room, create=create) as room_data:
+        if room_data['host'] not in room_data['users']:
+            # Room restored after a restart: its old host's socket is gone
+            room_data['host'] = request.sid
+        room_data['users'][request.sid] = {
+            'id': user_id,
+            'name': username,
+            'avatar': avatar
         }
     
-    party_rooms[room]['users'][request.sid] = {
-        'id': user_id,
-        'name': username,
-        'avatar': avatar
-    }
-    
     # Immediately send the current, authoritative party state to the user who just joined.
-    # The client should use this to sync its player and queue.
-    emit('party_state_update', party_rooms[room]['state'], room=request.sid)
+    # The client should use this to sync its player and queue, and keep its version for resyncs.
+    emit('party_state_update', party_state.snapshot(party_state.upgrade(room_data['state'])), room=request.sid)
 
     emit('party_notification', {'msg': f'{username} joined the party!'}, room=room)
-    emit_users(room)
+    emit_users(room, room_data)
 
-@socketio.on('leave_party')
+@socket_event('leave_party')
 def on_leave(data):
     room = str(data['room']).strip().lower()
     username = data.get('username', 'Guest')
     leave_room(room)
-    sid_to_room.pop(request.sid, None)
+    party_store.unbind(request.sid)
     
-    if room in party_rooms and request.sid in party_rooms[room]['users']:
-        del party_rooms[room]['users'][request.sid]
-        if party_rooms[room]['host'] == request.sid:
-            if party_rooms[room]['users']:
-                party_rooms[room]['host'] = next(iter(party_rooms[room]['users']))
-            else:
-                del party_rooms[room]
+    with party_store.room(room) as room_data:
+        if room_data and request.sid in room_data['users']:
+            del room_data['users'][request.sid]
+            if room_data['host'] == request.sid and room_data['users']:
+                room_data['host'] = next(iter(room_data['users']))
     
     emit('party_notification', {'msg': f'{username} left the party.'}, room=room)
-    emit_users(room)
+    if room_data and room_data['users']:
+        emit_users(room, room_data)
 
-@socketio.on('kick_user')
+@socket_event('kick_user')
 def on_kick(data):
     room = data.get('room')
     if room: room = str(room).strip().lower()
     target_id = data.get('targetId')
-    
-    if room in party_rooms and party_rooms[room]['host'] == request.sid:
-        target_sid = None
-        target_name = "User"
-        for sid, user in party_rooms[room]['users'].items():
-            if user['id'] == target_id:
-                target_sid = sid
-                target_name = user['name']
-                break
-        
-        if target_sid:
-            try:
-                leave_room(room, sid=target_sid)
-                sid_to_room.pop(target_sid, None)
-            except Exception: pass # Target might have already disconnected
-            
-            del party_rooms[room]['users'][target_sid]
-            emit('kicked', room=target_sid)
-            emit('party_notification', {'msg': f'{target_name} was kicked.'}, room=room)
-            emit_users(room)
-
-@socketio.on('disconnect')
-def on_disconnect():
+    if not room:
+        return
+
+    target_sid = None
+    target_name = "User"
+    with party_store.room(room) as room_data:
+        if room_data and room_data['host'] == request.sid:
+            for sid, user in room_data['users'].items():
+                if user['id'] == target_id:
+                    target_sid = sid
+                    target_name = user['name']
+                    break
+            if target_sid:
+                del room_data['users'][target_sid]
+
+    if target_sid:
+        try:
+            leave_room(room, sid=target_sid)
+        except Exception: pass # Target might have already disconnected
+        party_store.unbind(target_sid)
+
+        emit('kicked', room=target_sid)
+        emit('party_notification', {'msg': f'{target_name} was kicked.'}, room=room)
+        emit_users(room, room_data)
+
+@socket_event('disconnect')
+def on_disconnect(reason=None):
+    for limiter in (action_limiter, chat_limiter, typing_limiter):
+        limiter.forget(request.sid)
     try:
-        room_id = sid_to_room.pop(request.sid, None)
-        if not room_id or room_id not in party_rooms:
+        room_id = party_store.unbind(request.sid)
+        if not room_id:
             return
 
-        room_data = party_rooms[room_id]
-        user = room_data['users'].pop(request.sid, None)
+        with party_store.room(room_id) as room_data:
+            user = room_data['users'].pop(request.sid, None) if room_data else None
+            if user and room_data['host'] == request.sid and room_data['users']:
+                room_data['host'] = next(iter(room_data['users']))
         if not user:
             return
 
-        socketio.emit('party_notification', {'msg': f"{user.get('name', 'A user')} disconnected."}, room=room_id)
+        party_emit('party_notification', {'msg': f"{user.get('name', 'A user')} disconnected."}, room_id, room_data)
 
-        if not room_data['users']:
-            del party_rooms[room_id]
-        elif room_data['host'] == request.sid:
-            room_data['host'] = next(iter(room_data['users']))
-            emit_users(room_id)
-        else:
-            emit_users(room_id)
+        if room_data['users']:
+            emit_users(room_id, room_data)
     except Exception as e:
         print(f"Disconnect Error: {e}")
 
-@socketio.on('party_action')
+# Seek-bar drags and typing fire many events per second. Every action and chat
+# message is rate limited per socket, then playback changes are coalesced per
+# room (the first goes out at once, the rest of a burst is merged into one
+# trailing update); typing notices are throttled per user.
+PLAYBACK_ACTIONS = ('play', 'pause', 'seek')
+
+def merge_playback(pending, event):
+    merged = {**pending, **event}
+    if event['type'] == 'seek' and pending['type'] in ('play', 'pause'):
+        merged['type'] = pending['type'] # Keep the play/pause, with the later position
+    return merged
+
+def send_playback(room, event):
+    fields = {}
+    if event['type'] in ('play', 'pause'):
+        fields['isPlaying'] = event['type'] == 'play'
+    if 'time' in event:
+        fields['time'] = event['time']
+    if not fields:
+        return
+    with party_store.room(room) as room_data:
+        if room_data is None:
+            return
+        state = party_state.upgrade(room_data['state'])
+        op = party_state.playback(state, **fields)
+    event.update(time=state['time'], isPlaying=state['isPlaying'], version=op['v'], serverTs=state['at'])
+    party_emit('party_update', event, room, room_data)
+
+playback_events = Coalescer(
+    send_playback,
+    window=float(os.environ.get('PARTY_COALESCE_WINDOW', 0.15)),
+    merge=merge_playback,
+    spawn=socketio.start_background_task,
+    sleep=socketio.sleep,
+)
+action_limiter = RateLimiter(rate=float(os.environ.get('PARTY_ACTION_RATE', 5)), burst=int(os.environ.get('PARTY_ACTION_BURST', 20)))
+chat_limiter = RateLimiter(rate=float(os.environ.get('PARTY_CHAT_RATE', 1)), burst=int(os.environ.get('PARTY_CHAT_BURST', 5)))
+typing_limiter = RateLimiter(rate=1 / float(os.environ.get('PARTY_TYPING_INTERVAL', 2)), burst=1)
+
+@socket_event('party_action')
 def on_party_action(data):
     try:
-        # Robustly determine the room: prefer server-side state, fallback to payload
-        room = sid_to_room.get(request.sid)
-        if not room and data.get('room'):
-            room = str(data.get('room')).strip().lower()
-
         action_type = data.get('type')
-
-        if not room or not action_type:
-            print(f"Ignored Action (Missing Info): {action_type} | Room: {room} | SID: {request.sid}")
+        # Every event costs a token up front, malformed ones included
+        if not action_limiter.allow(request.sid):
+            return
+        if not action_type:
             return
 
-        if room not in party_rooms:
-            print(f"Ignored Action (Room Not Found): {room}")
+        # Robustly determine the room: prefer server-side state, fallback to payload
+        room = party_store.room_of(request.sid)
+        bound = room is not None
+        if not room and data.get('room'):
+            room = str(data.get('room')).strip().lower()
+        if not room:
             return
 
         # Auto-repair: If we know the room but socket isn't joined (e.g. server restart + client reconnect), fix it.
-        if request.sid not in sid_to_room:
+        if not bound:
+            if party_store.get(room) is None:
+                print(f"Ignored Action (Room Not Found): {room}")
+                return
             print(f"Auto-repairing connection for {request.sid} to {room}")
-            sid_to_room[request.sid] = room
+            party_store.bind(request.sid, room)
             join_room(room)
 
-        room_data = party_rooms[room]
-        is_host = request.sid == room_data['host']
-        state = room_data['state']
-
-        print(f"Party Action: {action_type} | Room: {room} | User: {request.sid} | IsHost: {is_host}")
-
         # Create a payload for broadcasting. Start with the original data.
         broadcast_data = data.copy()
         broadcast_data['senderSid'] = request.sid
@@ -438,95 +967,141 @@ def on_party_action(data):
         # Any user can perform any action. The server is the source of truth.
         # We allow 'play', 'pause', 'seek' for everyone (Collaborative Mode).
 
-        if action_type == 'play_song':
-            song_data = data.get('song')
-            if song_data:
-                state['song'] = song_data
-                state['time'] = 0
-                state['isPlaying'] = True
-                broadcast_data['time'] = 0
-                broadcast_data['isPlaying'] = True
-                socketio.emit('party_update', broadcast_data, room=room)
-
-                # Announce the new song in chat as a system message
-                chat_message = {
-                    'isSystem': True,
-                    'msg': f"Now playing: {song_data.get('title', 'a new song')} by {song_data.get('artist', 'Unknown Artist')}",
-                    'room': room
-                }
-                socketio.emit('party_chat', chat_message, room=room)
-
-        elif action_type == 'play':
-            state['isPlaying'] = True
-            if 'time' in data: state['time'] = data['time']
-            broadcast_data['time'] = state['time']
-            broadcast_data['isPlaying'] = True
-            socketio.emit('party_update', broadcast_data, room=room)
-
-        elif action_type == 'pause':
-            state['isPlaying'] = False
-            if 'time' in data: state['time'] = data['time']
-            broadcast_data['time'] = state['time']
-            broadcast_data['isPlaying'] = False
-            socketio.emit('party_update', broadcast_data, room=room)
-
-        elif action_type == 'seek':
-            if 'time' in data: state['time'] = data['time']
-            # The broadcast_data already contains the time from the original 'data'
-            socketio.emit('party_update', broadcast_data, room=room)
-
-        elif action_type == 'add_to_queue':
-            song_to_add = data.get('song')
-            if song_to_add and song_to_add.get('id') not in [s['id'] for s in state['queue']]:
-                state['queue'].append(song_to_add)
-                socketio.emit('party_update', broadcast_data, room=room)
-        
-        elif action_type == 'remove_from_queue':
-            song_id_to_remove = data.get('songId')
-            if song_id_to_remove:
-                state['queue'] = [s for s in state['queue'] if s['id'] != song_id_to_remove]
-                socketio.emit('party_update', broadcast_data, room=room)
-
-        elif action_type == 'update_queue':
-            new_queue = data.get('queue')
-            if isinstance(new_queue, list):
-                state['queue'] = new_queue
-                socketio.emit('party_update', broadcast_data, room=room)
+        if action_type in PLAYBACK_ACTIONS:
+            playback_events.submit(room, broadcast_data)
+            return
+
+        # Broadcasts are collected while the room is held and sent once it's saved
+        outbox = []
+        with party_store.room(room) as room_data:
+            if room_data is None:
+                print(f"Ignored Action (Room Not Found): {room}")
+                return
+
+            state = party_state.upgrade(room_data['state'])
+            # Queue changes are broadcast as ops at the new version instead of echoing the queue
+            queue_update = {'type': action_type, 'senderSid': request.sid}
+
+            if action_type == 'play_song':
+                song_data = data.get('song')
+                if song_data:
+                    playback_events.discard(room) # Positions scrubbed on the old song no longer apply
+                    op = party_state.playback(state, song=song_data, time=0, isPlaying=True)
+                    broadcast_data['time'] = 0
+                    broadcast_data['isPlaying'] = True
+                    broadcast_data['version'] = op['v']
+                    broadcast_data['serverTs'] = op['at']
+                    outbox.append(('party_update', broadcast_data))
+
+                    # Announce the new song in chat as a system message
+                    chat_message = {
+                        'isSystem': True,
+                        'msg': f"Now playing: {song_data.get('title', 'a new song')} by {song_data.get('artist', 'Unknown Artist')}",
+                        'room': room
+                    }
+                    outbox.append(('party_chat', chat_message))
+
+            elif action_type in ('add_to_queue', 'remove_from_queue', 'move_in_queue', 'update_queue'):
+                if action_type == 'add_to_queue':
+                    ops = [party_state.insert(state, data.get('song'), data.get('index'))]
+                elif action_type == 'remove_from_queue':
+                    ops = [party_state.remove(state, data.get('songId'))]
+                elif action_type == 'move_in_queue':
+                    ops = [party_state.move(state, data.get('songId'), data.get('index'))]
+                else:
+                    ops = party_state.set_queue(state, data['queue']) if isinstance(data.get('queue'), list) else []
+                ops = [op for op in ops if op]
+                if ops:
+                    queue_update['version'] = state['version']
+                    queue_update['ops'] = ops
+                    outbox.append(('party_update', queue_update))
+
+        for event, payload in outbox:
+            party_emit(event, payload, room, room_data)
+
+        if outbox:
+            # A new song or a reordered queue replaces the room's earlier prefetch
+            prefetch_tracks(f"party:{room}", party_state.upcoming(state))
     except Exception as e:
         print(f"Error in on_party_action: {e}")
         traceback.print_exc()
 
-@socketio.on('get_party_state')
+@socket_event('party_ping')
+def on_party_ping(data=None):
+    """NTP-style clock sync, answered as an ack: the client sends its send time t0,
+    notes its receive time t3, and estimates offset = serverTs - (t0 + t3) / 2."""
+    return {'t0': data.get('t0') if isinstance(data, dict) else None, 'serverTs': time.time()}
+
+# While a room is playing, its members get [version, position, server_ts] every few
+# seconds instead of having to ask for the state. Each room's heartbeat is sent by
+# the worker holding its host's socket, so it goes out once however many workers there are.
+# The same loop keeps this worker marked alive in the party store (it must run more
+# often than party_store.BOOT_TTL) and takes the sockets of dead workers out of their rooms.
+PARTY_HEARTBEAT_INTERVAL = float(os.environ.get('PARTY_HEARTBEAT_INTERVAL', 5))
+
+def run_party_heartbeat():
+    while True:
+        socketio.sleep(PARTY_HEARTBEAT_INTERVAL)
+        try:
+            for room in party_store.reap():
+                emit_users(room)
+        except Exception as e:
+            print(f"Party Reap Error: {e}")
+        bindings = party_store.local_bindings()
+        local_sids = {sid for sid, _ in bindings}
+        # One load per room, however many of its members are on this worker
+        for room in {room for _, room in bindings}:
+            try:
+                room_data = party_store.get(room)
+                if room_data and room_data['host'] in local_sids and room_data['state'].get('isPlaying'):
+                    state = party_state.upgrade(room_data['state'])
+                    party_emit('party_heartbeat', party_state.heartbeat(state), room, room_data)
+            except Exception as e:
+                print(f"Party Heartbeat Error ({room}): {e}")
+
+socketio.start_background_task(run_party_heartbeat)
+
+@socket_event('get_party_state')
 def on_get_state(data=None):
-    room = sid_to_room.get(request.sid)
+    """Sends the room's state. A client passing the `version` it last saw gets a
+    `party_ops` event with just the ops since then, when the log still has them."""
+    room = party_store.room_of(request.sid)
+    bound = room is not None
     if not room and data and isinstance(data, dict):
         room = data.get('room')
 
     if room:
         room = str(room).strip().lower()
 
-    if room and room in party_rooms:
-        if request.sid not in sid_to_room:
-            sid_to_room[request.sid] = room
+    room_data = party_store.get(room) if room else None
+    if room_data:
+        if not bound:
+            party_store.bind(request.sid, room)
             join_room(room)
-        emit('party_state_update', party_rooms[room]['state'], room=request.sid)
+        state = party_state.upgrade(room_data['state'])
+        ops = party_state.ops_since(state, data.get('version')) if isinstance(data, dict) else None
+        if ops is not None:
+            emit('party_ops', {'version': state['version'], 'ops': ops}, room=request.sid)
+        else:
+            emit('party_state_update', party_state.snapshot(state), room=request.sid)
 
-@socketio.on('party_chat')
+@socket_event('party_chat')
 def on_party_chat(data):
-    room = sid_to_room.get(request.sid)
+    room = party_store.room_of(request.sid)
     if not room and data.get('room'):
         room = str(data.get('room')).strip().lower()
         
-    if room:
+    if room and chat_limiter.allow(request.sid):
         socketio.emit('party_chat', data, room=room)
 
-@socketio.on('typing')
+@socket_event('typing')
 def on_typing(data):
-    room = sid_to_room.get(request.sid)
+    room = party_store.room_of(request.sid)
     if not room and data.get('room'):
         room = str(data.get('room')).strip().lower()
         
-    if room:
+    # One "is typing" notice per user per interval; the client shows it for a few seconds anyway
+    if room and typing_limiter.allow(request.sid):
         emit('typing', data, room=room, include_self=False)
 
 if __name__ == '__main__':
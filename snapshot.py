@@ -0,0 +1,104 @@
+import atexit
+import gzip
+import json
+import os
+import signal
+import sys
+import threading
+import time
+
+
+class Snapshots:
+    """Carries in-memory state across restarts in one compact file (gzipped JSON).
+
+    Components register a section with `dump()` and `restore(data)`. The file
+    is read once at startup and each section is restored as it's registered,
+    so the state is back before the server takes traffic. save() writes every
+    section atomically; it runs periodically (run_scheduler) and at exit.
+    Snapshots older than `max_age` are ignored. Without a path nothing is
+    read or written.
+    """
+
+    def __init__(self, path, max_age=24 * 3600):
+        self.path = path
+        self.max_age = max_age
+        self.sections = {}
+        self.restored = []
+        self.saves = 0
+        self.last_saved = None
+        self.last_bytes = 0
+        self._loaded = self._read()
+        self._lock = threading.Lock()
+        atexit.register(self.save)
+
+    def _read(self):
+        if not self.path:
+            return {}
+        try:
+            with gzip.open(self.path, 'rt', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Snapshot Read Error: {e}")
+            return {}
+        if time.time() - data.get('saved_at', 0) > self.max_age:
+            return {}
+        return data.get('sections', {})
+
+    def register(self, name, dump, restore):
+        self.sections[name] = dump
+        data = self._loaded.pop(name, None)
+        if data is None:
+            return
+        try:
+            restore(data)
+            self.restored.append(name)
+        except Exception as e:
+            print(f"Snapshot Restore Error ({name}): {e}")
+
+    def save(self):
+        if not self.path:
+            return
+        sections = {}
+        for name, dump in list(self.sections.items()):
+            try:
+                sections[name] = dump()
+            except Exception as e:
+                print(f"Snapshot Dump Error ({name}): {e}")
+        # Workers may share the file: each writes its own temp file, the last rename wins
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with self._lock:
+            try:
+                with gzip.open(tmp, 'wt', encoding='utf-8', compresslevel=6) as f:
+                    json.dump({'saved_at': time.time(), 'sections': sections}, f, separators=(',', ':'), default=str)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                print(f"Snapshot Save Error: {e}")
+                return
+            self.saves += 1
+            self.last_saved = time.time()
+            self.last_bytes = os.path.getsize(self.path)
+
+    def run_scheduler(self, sleep, interval):
+        while True:
+            sleep(interval)
+            self.save()
+
+    def stats(self):
+        return {'path': self.path, 'restored': self.restored, 'saves': self.saves,
+                'last_saved': self.last_saved, 'bytes': self.last_bytes}
+
+
+def exit_on_sigterm():
+    """Turns SIGTERM into a normal exit, so atexit handlers (snapshot, queued writes) run.
+
+    Left alone when something else handles it already, e.g. gunicorn, whose
+    workers shut down gracefully and exit normally anyway.
+    """
+    if signal.getsignal(signal.SIGTERM) != signal.SIG_DFL:
+        return
+    try:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    except ValueError:  # Not the main thread
+        pass
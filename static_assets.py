@@ -0,0 +1,135 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+try:
+    import brotli
+except ImportError:  # Optional: without it assets are only gzipped
+    brotli = None
+
+ASSET_EXTENSIONS = ('.html', '.css', '.js', '.json', '.png', '.jpg', '.jpeg', '.svg', '.ico', '.webp', '.woff2')
+COMPRESSIBLE = ('.html', '.css', '.js', '.json', '.svg')
+FINGERPRINTED = ('.css', '.js')
+UNVERSIONED = {'sw.js'}  # A service worker has to stay at the URL it was registered with
+
+_REFERENCE = re.compile(r'((?:src|href)=")([\w.-]+\.(?:css|js))(?:\?[^"]*)?(")')
+_PRECACHE = re.compile(r'/\*PRECACHE\*/.*?/\*END PRECACHE\*/', re.S)
+
+
+def _accepts(accept_encoding, coding):
+    """Whether an Accept-Encoding header allows `coding` (q > 0)."""
+    for part in (accept_encoding or '').lower().split(','):
+        name, _, params = part.strip().partition(';')
+        if name.strip() not in (coding, '*'):
+            continue
+        q = params.strip()
+        return not (q.startswith('q=') and q[2:].strip() in ('0', '0.0', '0.00', '0.000'))
+    return False
+
+
+class Asset:
+    """One file held in memory, with a compressed copy per encoding worth having."""
+
+    def __init__(self, name, data):
+        self.name = name
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or name.endswith(('.js', '.json', '.svg')):
+            content_type += '; charset=utf-8'
+        self.content_type = content_type
+        self.digest = hashlib.sha256(data).hexdigest()
+        self.bodies = {None: data}
+        if name.endswith(COMPRESSIBLE) and len(data) > 512:
+            candidates = {'gzip': gzip.compress(data, 9, mtime=0)}
+            if brotli is not None:
+                candidates['br'] = brotli.compress(data, quality=11)
+            self.bodies.update((coding, body) for coding, body in candidates.items() if len(body) < len(data))
+
+    def negotiate(self, accept_encoding):
+        """The best encoding the client accepts (None for identity)."""
+        for coding in ('br', 'gzip'):
+            if coding in self.bodies and _accepts(accept_encoding, coding):
+                return coding
+        return None
+
+    def etag(self, coding):
+        # Strong, and different per encoding, since each is a different byte sequence
+        return f"{self.digest[:24]}-{coding}" if coding else self.digest[:24]
+
+
+class StaticAssets:
+    """The frontend's files, loaded once at startup and served from memory.
+
+    Only top-level files in `root` with a known extension are picked up, so
+    sources and databases next to them are never reachable. CSS and JS also
+    get a content-hashed URL (style.<hash>.css) that HTML pages are rewritten
+    to reference, which lets browsers keep them forever. The list of those
+    URLs is the precache manifest, injected into sw.js between its
+    /*PRECACHE*/ markers along with a version that changes with any asset.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        self.assets = {}  # url path -> (Asset, fingerprinted)
+        self.manifest = {}
+        self.load()
+
+    def load(self):
+        files = {}
+        for name in sorted(os.listdir(self.root)):
+            path = os.path.join(self.root, name)
+            if name.endswith(ASSET_EXTENSIONS) and not name.startswith('.') and os.path.isfile(path):
+                with open(path, 'rb') as f:
+                    files[name] = f.read()
+
+        fingerprints = {}
+        for name, data in files.items():
+            if name.endswith(FINGERPRINTED) and name not in UNVERSIONED:
+                base, ext = os.path.splitext(name)
+                fingerprints[name] = f"{base}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+        def reference(match):
+            url = fingerprints.get(match.group(2))
+            return f"{match.group(1)}{url}{match.group(3)}" if url else match.group(0)
+
+        for name in files:
+            if name.endswith('.html'):
+                files[name] = _REFERENCE.sub(reference, files[name].decode('utf-8')).encode('utf-8')
+
+        version = hashlib.sha256()
+        for name, data in files.items():
+            if name not in UNVERSIONED:
+                version.update(name.encode() + b'\0' + hashlib.sha256(data).digest())
+        urls = ['/index.html'] if 'index.html' in files else []
+        urls += [f"/{url}" for url in fingerprints.values()]
+        if 'manifest.json' in files:
+            urls.append('/manifest.json')
+        self.manifest = {'version': version.hexdigest()[:12], 'urls': urls}
+
+        if 'sw.js' in files:
+            injected = f"/*PRECACHE*/{json.dumps(self.manifest)}/*END PRECACHE*/"
+            files['sw.js'] = _PRECACHE.sub(lambda _: injected, files['sw.js'].decode('utf-8')).encode('utf-8')
+
+        assets = {}
+        for name, data in files.items():
+            asset = Asset(name, data)
+            assets[name] = (asset, False)
+            if name in fingerprints:
+                assets[fingerprints[name]] = (asset, True)
+        self.assets = assets
+
+    def get(self, path):
+        """(Asset, fingerprinted) for a URL path, or None."""
+        return self.assets.get(path.lstrip('/'))
+
+    def stats(self):
+        unique = {id(asset): asset for asset, _ in self.assets.values()}.values()
+        return {
+            'version': self.manifest.get('version'),
+            'files': len(unique),
+            'bytes': sum(len(a.bodies[None]) for a in unique),
+            'compressed_bytes': {coding: sum(len(a.bodies.get(coding, a.bodies[None])) for a in unique)
+                                 for coding in ('gzip', 'br') if coding == 'gzip' or brotli is not None},
+        }
@@ -0,0 +1,167 @@
+import atexit
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from background import spawn_thread
+
+
+class Database:
+    """A SQLite file opened in WAL mode behind a small connection pool.
+
+    WAL lets readers carry on while a write is in progress, and synchronous=NORMAL
+    drops the fsync on every commit (a checkpoint still syncs). Connections are
+    long-lived, so sqlite3's per-connection statement cache means each SQL string
+    is only prepared once.
+    """
+
+    def __init__(self, path, pool_size=4, busy_timeout_ms=5000):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._pool = queue.LifoQueue(maxsize=pool_size)
+
+    def _connect(self):
+        # isolation_level=None: transactions are explicit, see transaction()
+        conn = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        return conn
+
+    @contextmanager
+    def connection(self):
+        try:
+            conn = self._pool.get_nowait()
+        except queue.Empty:
+            conn = self._connect()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            try:
+                self._pool.put_nowait(conn)
+            except queue.Full:
+                conn.close()
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, rolled back if the block raises."""
+        with self.connection() as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def execute(self, sql, params=()):
+        with self.connection() as conn:
+            return conn.execute(sql, params).fetchall()
+
+    def executemany(self, sql, rows):
+        with self.transaction() as conn:
+            conn.executemany(sql, rows)
+
+    def close(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class WriteBehind:
+    """Queues writes per key and commits everything queued within `window` seconds
+    in a single transaction.
+
+    `apply(conn, key, items)` receives every item queued for that key since the
+    last flush, in order, so repeated writes for the same key can be merged.
+    Each key is applied in its own savepoint: a key whose apply raises is
+    rolled back and dropped without taking the rest of the batch with it. The
+    whole batch is retried only when the transaction itself fails (e.g. the
+    database is locked). After a commit, `on_done(key, error)` is called for
+    every key in the batch, with the exception for dropped ones. Pending
+    writes are flushed at interpreter exit.
+    """
+
+    def __init__(self, db, apply, window=0.5, spawn=None, sleep=time.sleep, on_done=None):
+        self.db = db
+        self.apply = apply
+        self.window = window
+        self.on_done = on_done
+        self._spawn = spawn or spawn_thread
+        self._sleep = sleep
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._scheduled = False
+        self.flushes = 0
+        self.merged = 0
+        self.dropped = 0
+        atexit.register(self.flush)
+
+    def submit(self, key, item):
+        with self._lock:
+            items = self._pending.setdefault(key, [])
+            if items:
+                self.merged += 1
+            items.append(item)
+            schedule = not self._scheduled
+            self._scheduled = True
+        if schedule:
+            self._spawn(self._flush_later)
+
+    def _flush_later(self):
+        self._sleep(self.window)
+        self.flush()
+
+    def flush(self):
+        # Serialized so a caller that needs to read its own writes waits for an in-progress flush
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                self._scheduled = False
+            if not pending:
+                return
+            errors = {}
+            try:
+                with self.db.transaction() as conn:
+                    for key, items in pending.items():
+                        conn.execute("SAVEPOINT write_behind_key")
+                        try:
+                            self.apply(conn, key, items)
+                        except Exception as e:
+                            conn.execute("ROLLBACK TO write_behind_key")
+                            errors[key] = e
+                        conn.execute("RELEASE write_behind_key")
+                self.flushes += 1
+            except Exception as e:
+                print(f"Write-behind Flush Error: {e}")
+                # Put the batch back in front of anything queued meanwhile and try again later
+                with self._lock:
+                    for key, items in pending.items():
+                        self._pending[key] = items + self._pending.get(key, [])
+                    schedule = not self._scheduled
+                    self._scheduled = True
+                if schedule:
+                    self._spawn(self._flush_later)
+                return
+            for key, error in errors.items():
+                self.dropped += 1
+                print(f"Write-behind Dropped Write ({key}): {error}")
+            if self.on_done:
+                for key in pending:
+                    self.on_done(key, errors.get(key))
+
+    def is_pending(self, key):
+        with self._lock:
+            return key in self._pending
+
+    def stats(self):
+        with self._lock:
+            return {'pending_keys': len(self._pending), 'flushes': self.flushes, 'merged': self.merged,
+                    'dropped': self.dropped}
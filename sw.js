@@ -1,9 +1,9 @@
-const CACHE_NAME = 'aura-music-cache-v14';
+// The server replaces this with its asset manifest: content-hashed URLs and a version
+// that changes with any asset (see static_assets.py). The default is for static hosting.
+const PRECACHE = /*PRECACHE*/{"version": "v14", "urls": ["/index.html", "/style.css?v=4", "/hover_queue.js?v=4", "/auth_manager.js"]}/*END PRECACHE*/;
+const CACHE_NAME = 'aura-music-cache-' + PRECACHE.version;
 const urlsToCache = [
-  '/index.html',
-  '/style.css?v=4',
-  '/hover_queue.js?v=4',
-  '/auth_manager.js',
+  ...PRECACHE.urls,
   'https://unpkg.com/lucide@latest'
 ];
 
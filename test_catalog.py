@@ -0,0 +1,37 @@
+import pytest
+
+from catalog import TrackCatalog, _clean
+from storage import Database
+
+TRACK = {'id': 'vid00000001', 'title': 'Blue Monday', 'artist': 'New Order', 'artistId': 'UCnew',
+         'thumb': 'https://i.ytimg.com/vi/vid00000001/hqdefault.jpg', 'duration': 448}
+
+
+@pytest.mark.parametrize('thumb', [
+    'https://i.ytimg.com/vi/x/hqdefault.jpg',
+    'https://lh3.googleusercontent.com/abc=w120-h120',
+])
+def test_keeps_youtube_thumbnails(thumb):
+    assert _clean({**TRACK, 'thumb': thumb})['thumb'] == thumb
+
+
+@pytest.mark.parametrize('thumb', [
+    'http://i.ytimg.com/vi/x/hqdefault.jpg',
+    'https://evil.example/ytimg.com/x.jpg',
+    'https://i.ytimg.com.evil.example/x.jpg',
+    'https://notytimg.com/x.jpg',
+    'javascript:alert(1)',
+    '" onerror="alert(1)',
+    None,
+])
+def test_drops_other_thumbnails(thumb):
+    assert _clean({**TRACK, 'thumb': thumb})['thumb'] == ''
+
+
+def test_search_finds_added_tracks(tmp_path):
+    catalog = TrackCatalog(Database(str(tmp_path / 'cache.db')), write_window=0)
+    catalog.add([TRACK, {**TRACK, 'id': 'bad id!'}, {'title': 'No id'}])
+    catalog.writes.flush()
+    assert catalog.search('blue mon') == [TRACK]
+    assert catalog.search('new order', prefix=False) == [TRACK]
+    assert catalog.search('joy division') == []
@@ -0,0 +1,85 @@
+import threading
+import time
+
+from lyrics_resolver import LyricsResolver
+
+LRCLIB = {'lyrics': 'from lrclib', 'synced': True}
+YT = {'lyrics': 'from yt', 'synced': False}
+OFFICIAL = {'lyrics': 'from the official video', 'synced': False}
+
+
+def answer(result, delay=0.0):
+    """A stub source that answers `result` (or raises it) after `delay` seconds."""
+    def source(*args):
+        time.sleep(delay)
+        if isinstance(result, Exception):
+            raise result
+        return result
+    return source
+
+
+def make_resolver(lrclib, yt, official_id=answer(None), **timeouts):
+    return LyricsResolver(lrclib, yt, official_id, **{'lrclib_timeout': 0.5, 'yt_timeout': 0.5,
+                                                        'fallback_timeout': 0.5, **timeouts})
+
+
+def test_prefers_lrclib_even_when_youtube_answers_first():
+    resolver = make_resolver(answer(LRCLIB, 0.1), answer(YT))
+    assert resolver.resolve('Song', 'Artist', 'vid00000001') == (LRCLIB, 'lrclib', True)
+
+
+def test_falls_through_in_order_when_sources_have_nothing():
+    resolver = make_resolver(answer(None), answer(YT))
+    assert resolver.resolve('Song', 'Artist', 'vid00000001') == (YT, 'yt', True)
+    resolver = make_resolver(answer({'lyrics': ''}), answer(None))
+    assert resolver.resolve('Song', 'Artist', 'vid00000001') == (None, None, True)
+
+
+def test_slow_source_is_cut_off_at_its_deadline():
+    resolver = make_resolver(answer(LRCLIB, 2.0), answer(YT), lrclib_timeout=0.2)
+    started = time.monotonic()
+    assert resolver.resolve('Song', 'Artist', 'vid00000001') == (YT, 'yt', False)
+    assert time.monotonic() - started < 1.0
+
+
+def test_failed_source_marks_the_answer_incomplete():
+    resolver = make_resolver(answer(RuntimeError('down')), answer(None))
+    assert resolver.resolve('Song', 'Artist', 'vid00000001') == (None, None, False)
+
+
+def test_fallback_starts_as_soon_as_lookup_by_id_is_empty():
+    fallback_started = threading.Event()
+
+    def find_official_id(title, artist):
+        fallback_started.set()
+        return 'official0001'
+
+    def fetch_yt(video_id):
+        return OFFICIAL if video_id == 'official0001' else None
+
+    def fetch_lrclib(title, artist):
+        # Still running when the fallback starts: the two overlap
+        assert fallback_started.wait(1.0)
+        return None
+
+    resolver = make_resolver(fetch_lrclib, fetch_yt, find_official_id)
+    assert resolver.resolve('Song', 'Artist', 'vid00000001') == (OFFICIAL, 'fallback', True)
+
+
+def test_fallback_skips_the_video_already_looked_up():
+    calls = []
+
+    def fetch_yt(video_id):
+        calls.append(video_id)
+        return None
+
+    resolver = make_resolver(answer(None), fetch_yt, answer('vid00000001'))
+    assert resolver.resolve('Song', 'Artist', 'vid00000001') == (None, None, True)
+    assert calls == ['vid00000001']
+
+
+def test_only_the_sources_the_request_allows():
+    resolver = make_resolver(answer(LRCLIB), answer(YT))
+    assert resolver.resolve(None, None, 'vid00000001') == (YT, 'yt', True)
+    assert resolver.resolve('Song', 'Artist', None) == (LRCLIB, 'lrclib', True)
+    assert resolver.resolve(None, None, None) == (None, None, True)
@@ -0,0 +1,92 @@
+import time
+
+import pytest
+
+from party_store import RedisPartyStore, SqlitePartyStore
+from storage import Database
+
+
+@pytest.fixture(params=['sqlite', 'redis'])
+def make_store(request, tmp_path, monkeypatch):
+    """Builds stores that share one backend, like the workers of a deployment."""
+    if request.param == 'sqlite':
+        path = str(tmp_path / 'party.db')
+        return lambda: SqlitePartyStore(Database(path))
+    redis = pytest.importorskip('redis')
+    fakeredis = pytest.importorskip('fakeredis')
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(redis.Redis, 'from_url', lambda url: fakeredis.FakeRedis(server=server))
+    return lambda: RedisPartyStore('redis://party')
+
+
+def kill(store):
+    """The process dies without exiting: its sockets stay bound and it stops calling reap()."""
+    store._local.clear()
+    if isinstance(store, SqlitePartyStore):
+        store.db.execute("UPDATE party_boots SET seen_at = ? WHERE boot = ?", (time.time() - 2 * store.boot_ttl, store.boot))
+    else:
+        store.redis.delete(f"{store.prefix}alive:{store.boot}")
+
+
+def join(store, sid, room_id):
+    with store.room(room_id, create=lambda: {'host': sid, 'users': {}, 'state': {}}) as data:
+        data['users'][sid] = {'name': sid}
+    store.bind(sid, room_id)
+
+
+def test_bind_and_unbind(make_store):
+    store = make_store()
+    join(store, 'sid1', 'room1')
+    assert store.room_of('sid1') == 'room1'
+    assert store.local_bindings() == [('sid1', 'room1')]
+    assert store.unbind('sid1') == 'room1'
+    assert store.room_of('sid1') is None
+    assert store.unbind('sid1') is None
+    assert store.local_bindings() == []
+
+
+def test_room_is_kept_when_one_member_disconnects(make_store):
+    store = make_store()
+    join(store, 'sid1', 'room1')
+    join(store, 'sid2', 'room1')
+
+    # What the disconnect handler does
+    room_id = store.unbind('sid1')
+    with store.room(room_id) as data:
+        data['users'].pop('sid1')
+        data['host'] = next(iter(data['users']))
+
+    assert store.get('room1') == {'host': 'sid2', 'users': {'sid2': {'name': 'sid2'}}, 'state': {}}
+    assert store.room_of('sid2') == 'room1'
+
+
+def test_reap_releases_the_sockets_of_a_dead_process(make_store):
+    dead, alive = make_store(), make_store()
+    join(dead, 'sid1', 'shared')
+    join(alive, 'sid2', 'shared')
+    join(dead, 'sid3', 'lonely')
+    kill(dead)
+
+    assert alive.reap() == {'shared', 'lonely'}
+    assert alive.get('shared') == {'host': 'sid2', 'users': {'sid2': {'name': 'sid2'}}, 'state': {}}
+    assert alive.get('lonely') is None
+    assert alive.room_of('sid1') is None and alive.room_of('sid3') is None
+    assert alive.room_of('sid2') == 'shared'
+    assert alive.reap() == set()
+
+
+def test_reap_leaves_live_processes_alone(make_store):
+    first, second = make_store(), make_store()
+    join(first, 'sid1', 'room1')
+    assert second.reap() == set()
+    assert second.room_of('sid1') == 'room1'
+
+
+def test_unbind_by_another_process_forgets_the_binding(make_store):
+    first, second = make_store(), make_store()
+    join(first, 'sid1', 'room1')
+    assert second.unbind('sid1') == 'room1'
+    if isinstance(first, RedisPartyStore):
+        assert not first.redis.smembers(f"{first.prefix}boot:{first.boot}")
+    kill(first)
+    assert second.reap() == set()
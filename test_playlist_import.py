@@ -0,0 +1,48 @@
+from benchmark import _tracks, browse_playlist_page
+from playlist_import import iter_playlist_pages
+
+
+def recording_send(bodies):
+    def send(body):
+        bodies.append(body)
+        return browse_playlist_page(body)
+    return send
+
+
+def test_pages_through_the_whole_playlist():
+    bodies = []
+    pages = list(iter_playlist_pages(recording_send(bodies), 'PLmix'))
+
+    assert [title for title, _, _ in pages] == ['Playlist VLPLmix', None, None]
+    assert [len(tracks) for _, tracks, _ in pages] == [100, 100, 50]
+    assert [cursor for _, _, cursor in pages] == ['VLPLmix:100', 'VLPLmix:200', None]
+    assert bodies[0] == {'browseId': 'VLPLmix'}
+    ids = [track['videoId'] for _, tracks, _ in pages for track in tracks]
+    assert ids == [track['videoId'] for track in _tracks('VLPLmix', 250)]
+
+
+def test_parses_tracks_like_get_playlist():
+    _, tracks, _ = next(iter_playlist_pages(browse_playlist_page, 'VLPLmix'))
+    expected = _tracks('VLPLmix', 1)[0]
+    assert tracks[0]['title'] == expected['title']
+    assert tracks[0]['artists'] == expected['artists']
+    assert tracks[0]['thumbnails'] == expected['thumbnails']
+    assert tracks[0]['duration'] == expected['duration']
+
+
+def test_resumes_after_a_cursor():
+    bodies = []
+    pages = list(iter_playlist_pages(recording_send(bodies), 'PLmix', cursor='VLPLmix:200'))
+
+    assert bodies == [{'continuation': 'VLPLmix:200'}]
+    assert [(title, len(tracks), cursor) for title, tracks, cursor in pages] == [(None, 50, None)]
+
+
+def test_stops_on_an_empty_continuation():
+    def send(body):
+        if 'continuation' in body:
+            return {}
+        return browse_playlist_page(body)
+
+    pages = list(iter_playlist_pages(send, 'PLmix'))
+    assert [len(tracks) for _, tracks, _ in pages] == [100]
@@ -0,0 +1,48 @@
+import importlib
+import json
+import re
+
+import pytest
+
+
+@pytest.fixture(scope='module')
+def client(tmp_path_factory):
+    # server.py keeps its databases in the working directory
+    with pytest.MonkeyPatch.context() as mp:
+        mp.chdir(tmp_path_factory.mktemp('server'))
+        mp.setenv('PARTY_STORE', 'memory')
+        server = importlib.import_module('server')
+        yield server.app.test_client()
+
+
+def precache(client):
+    sw = client.get('/sw.js').get_data(as_text=True)
+    return json.loads(re.search(r'/\*PRECACHE\*/(.*?)/\*END PRECACHE\*/', sw).group(1))['urls']
+
+
+def test_index_is_served_at_both_urls(client):
+    root, index = client.get('/'), client.get('/index.html')
+    assert root.status_code == index.status_code == 200
+    assert root.get_data() == index.get_data()
+    assert root.content_type == 'text/html; charset=utf-8'
+
+
+def test_every_precached_url_is_served(client):
+    urls = precache(client)
+    assert '/index.html' in urls
+    for url in urls:
+        assert client.get(url).status_code == 200, url
+
+
+def test_hashed_urls_are_immutable_and_revalidated_otherwise(client):
+    hashed = [url for url in precache(client) if re.search(r'\.[0-9a-f]{10}\.(css|js)$', url)]
+    assert hashed
+    assert 'immutable' in client.get(hashed[0]).headers['Cache-Control']
+    response = client.get('/index.html')
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert client.get('/index.html', headers={'If-None-Match': response.headers['ETag']}).status_code == 304
+
+
+def test_only_assets_are_served(client):
+    for url in ('/server.py', '/aura_users.db', '/requirements.txt', '/../server.py'):
+        assert client.get(url).status_code == 404, url
@@ -0,0 +1,61 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from upstream import bounded_map, deadline, pooled_session, submit_with_deadline
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(float(self.path.strip('/')))
+        self.send_response(200)
+        self.send_header('Content-Length', '2')
+        self.end_headers()
+        self.wfile.write(b'ok')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope='module')
+def slow_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.fixture
+def pool():
+    executor = ThreadPoolExecutor(max_workers=4)
+    yield executor
+    executor.shutdown(wait=False)
+
+
+def test_fanned_out_calls_are_cut_off_at_the_callers_deadline(slow_url, pool):
+    session = pooled_session(timeout=10)
+    started = time.monotonic()
+    with deadline(0.3):
+        results = bounded_map(pool, lambda delay: session.get(f"{slow_url}/{delay}").text, [0, 2, 2], 2)
+    assert time.monotonic() - started < 1.5
+    assert results[0] == 'ok'
+    assert all(isinstance(result, requests.exceptions.Timeout) for result in results[1:])
+
+
+def test_submitted_work_gets_the_budget_left_at_submit_time(slow_url, pool):
+    session = pooled_session(timeout=10)
+    with deadline(0.1):
+        time.sleep(0.15)
+        future = submit_with_deadline(pool, session.get, f"{slow_url}/0")
+    with pytest.raises(requests.exceptions.Timeout):
+        future.result(timeout=1)
+
+
+def test_without_a_deadline_work_runs_unbounded(slow_url, pool):
+    session = pooled_session(timeout=10)
+    assert submit_with_deadline(pool, session.get, f"{slow_url}/0.2").result(timeout=5).text == 'ok'
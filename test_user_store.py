@@ -0,0 +1,45 @@
+import pytest
+
+from storage import Database
+from user_store import InvalidPatch, UserStore
+
+TRACK = {'id': 'vid00000001', 'title': 'Song'}
+
+
+@pytest.fixture
+def store(tmp_path):
+    db = Database(str(tmp_path / 'users.db'))
+    with db.transaction() as conn:
+        conn.execute("CREATE TABLE users (google_id TEXT PRIMARY KEY, email TEXT, data TEXT)")
+    store = UserStore(db, write_window=0)
+    store.login('g1', 'user@example.com')
+    return store
+
+
+def test_replaces_the_whole_library(store):
+    data = {'likedSongs': [TRACK], 'recentSongs': [TRACK], 'playlists': {'Mix': {'tracks': [TRACK]}}}
+    assert store.write('g1', data=data) == 1
+    stored, rev = store.load('g1')
+    assert rev == 1
+    assert stored['likedSongs'] == [TRACK]
+    assert stored['recentSongs'] == [TRACK]
+    assert stored['playlists'] == {'Mix': {'tracks': [TRACK], 'cover': None}}
+
+
+@pytest.mark.parametrize('data', [
+    [],
+    {'playlists': [{'tracks': []}]},
+    {'likedSongs': {'vid00000001': TRACK}},
+    {'likedSongs': ['vid00000001']},
+    {'recentSongs': 'vid00000001'},
+    {'recentSongs': [TRACK, None]},
+])
+def test_rejects_a_malformed_library(store, data):
+    with pytest.raises(InvalidPatch):
+        store.write('g1', data=data)
+    assert store.load('g1') == ({'likedSongs': [], 'recentSongs': [], 'playlists': {}}, 0)
+
+
+def test_login_skips_a_malformed_legacy_library(store):
+    store.db.execute("UPDATE users SET data = ? WHERE google_id = 'g1'", ('{"playlists": []}',))
+    assert store.login('g1', 'user@example.com') == ({'likedSongs': [], 'recentSongs': [], 'playlists': {}}, 1)
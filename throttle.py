@@ -0,0 +1,111 @@
+import threading
+import time
+
+from background import spawn_thread
+
+
+class Coalescer:
+    """Per-key throttle that merges bursts into their latest state.
+
+    The first event for a key goes out right away. Anything arriving within the
+    next `window` seconds is folded together with `merge(pending, event)` and
+    sent once at the end of the window, so the last event of a burst is never
+    lost. `send(key, event)` does the delivery.
+    """
+
+    def __init__(self, send, window=0.15, merge=None, spawn=None, sleep=time.sleep):
+        self.send = send
+        self.window = window
+        self.merge = merge or (lambda pending, event: event)
+        self._spawn = spawn or spawn_thread
+        self._sleep = sleep
+        self._keys = {}  # key -> {'until': monotonic, 'pending': event or None, 'timer': bool}
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.merged = 0
+
+    def submit(self, key, event):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry is None or (now >= entry['until'] and not entry['timer']):
+                self._keys[key] = {'until': now + self.window, 'pending': None, 'timer': False}
+                if len(self._keys) > 1000:
+                    self._prune(now)
+            else:
+                if entry['pending'] is None:
+                    entry['pending'] = event
+                else:
+                    entry['pending'] = self.merge(entry['pending'], event)
+                    self.merged += 1
+                if not entry['timer']:
+                    entry['timer'] = True
+                    self._spawn(self._send_later, key)
+                return
+        self.sent += 1
+        self.send(key, event)
+
+    def discard(self, key):
+        """Drops whatever is pending for the key, e.g. when a newer event supersedes it."""
+        with self._lock:
+            entry = self._keys.get(key)
+            if entry:
+                entry['pending'] = None
+
+    def _send_later(self, key):
+        with self._lock:
+            delay = self._keys[key]['until'] - time.monotonic()
+        if delay > 0:
+            self._sleep(delay)
+        with self._lock:
+            entry = self._keys[key]
+            event, entry['pending'] = entry['pending'], None
+            entry['timer'] = False
+            entry['until'] = time.monotonic() + self.window
+        if event is not None:
+            self.sent += 1
+            try:
+                self.send(key, event)
+            except Exception as e:
+                print(f"Coalesced Send Error ({key}): {e}")
+
+    def _prune(self, now):
+        for key in [k for k, e in self._keys.items() if now >= e['until'] and not e['timer']]:
+            del self._keys[key]
+
+    def stats(self):
+        return {'keys': len(self._keys), 'sent': self.sent, 'merged': self.merged}
+
+
+class RateLimiter:
+    """Token bucket per key: `rate` events per second with bursts of up to `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}  # key -> [tokens, last monotonic]
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.limited = 0
+
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                self.limited += 1
+                return False
+            bucket[0] -= 1
+            self.allowed += 1
+            return True
+
+    def forget(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+    def stats(self):
+        return {'keys': len(self._buckets), 'allowed': self.allowed, 'limited': self.limited}
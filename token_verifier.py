@@ -0,0 +1,83 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from google.auth import jwt
+
+GOOGLE_CERTS_URL = 'https://www.googleapis.com/oauth2/v1/certs'
+GOOGLE_ISSUERS = ('accounts.google.com', 'https://accounts.google.com')
+
+
+def parse_max_age(cache_control):
+    """Returns the max-age (seconds) from a Cache-Control header, or None."""
+    match = re.search(r'max-age=(\d+)', cache_control or '')
+    return int(match.group(1)) if match else None
+
+
+class TokenVerifier:
+    """Drop-in for id_token.verify_oauth2_token that avoids repeat work.
+
+    Google's signing certs are cached for as long as their Cache-Control max-age
+    allows, and tokens that verified successfully are remembered until their
+    `exp`, so repeat syncs from one session skip both the cert fetch and the RSA
+    check. Invalid tokens raise ValueError, like the google-auth helper.
+    """
+
+    def __init__(self, fetch_certs, default_max_age=3600, clock_skew=10, max_tokens=10000):
+        self.fetch_certs = fetch_certs  # () -> (certs, max_age or None)
+        self.default_max_age = default_max_age
+        self.clock_skew = clock_skew
+        self.max_tokens = max_tokens
+        self._certs = None
+        self._certs_expire_at = 0
+        self._last_forced_refresh = 0
+        self._tokens = OrderedDict()  # sha256(token|audience) -> id_info
+        self._lock = threading.Lock()
+        self.cert_fetches = 0
+        self.cache_hits = 0
+
+    def _get_certs(self, force=False):
+        if force or self._certs is None or time.time() >= self._certs_expire_at:
+            certs, max_age = self.fetch_certs()
+            self.cert_fetches += 1
+            self._certs = certs
+            self._certs_expire_at = time.time() + (self.default_max_age if max_age is None else max_age)
+        return self._certs
+
+    def verify(self, token, audience=None):
+        if isinstance(token, bytes):
+            token = token.decode('utf-8')
+        key = hashlib.sha256(f"{token}|{audience}".encode()).hexdigest()
+        now = time.time()
+        with self._lock:
+            id_info = self._tokens.get(key)
+            if id_info is not None:
+                if id_info['exp'] > now:
+                    self.cache_hits += 1
+                    return dict(id_info)
+                del self._tokens[key]
+
+        try:
+            id_info = jwt.decode(token, certs=self._get_certs(), audience=audience,
+                                 clock_skew_in_seconds=self.clock_skew)
+        except ValueError as e:
+            # Google rotated its keys before our cached set expired: refetch once, rarely
+            if 'Certificate for key id' not in str(e) or now - self._last_forced_refresh < 60:
+                raise
+            self._last_forced_refresh = now
+            id_info = jwt.decode(token, certs=self._get_certs(force=True), audience=audience,
+                                 clock_skew_in_seconds=self.clock_skew)
+
+        if id_info.get('iss') not in GOOGLE_ISSUERS:
+            raise ValueError(f"Wrong issuer. 'iss' should be one of the following: {GOOGLE_ISSUERS}")
+
+        with self._lock:
+            self._tokens[key] = id_info
+            while len(self._tokens) > self.max_tokens:
+                self._tokens.popitem(last=False)
+        return dict(id_info)
+
+    def stats(self):
+        return {'cached_tokens': len(self._tokens), 'cache_hits': self.cache_hits, 'cert_fetches': self.cert_fetches}
@@ -0,0 +1,274 @@
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+_local = threading.local()
+
+
+class UpstreamUnavailable(Exception):
+    """Raised without calling out when an upstream's circuit breaker is open."""
+
+
+class UpstreamTimeout(requests.exceptions.Timeout):
+    """Raised when a call's deadline runs out before the next HTTP request is sent."""
+
+
+@contextmanager
+def deadline(seconds):
+    """Bounds every HTTP request made through a pooled session inside the block.
+
+    Calls that make several requests (e.g. paging through a playlist) share the
+    same budget. Nested deadlines can only shorten the outer one.
+    """
+    previous = getattr(_local, 'deadline', None)
+    new = time.monotonic() + seconds
+    _local.deadline = new if previous is None else min(previous, new)
+    try:
+        yield
+    finally:
+        _local.deadline = previous
+
+
+def submit_with_deadline(executor, fn, *args, **kwargs):
+    """executor.submit() that runs fn under the caller's deadline(), if any.
+
+    deadline() is per thread, so work handed to a pool would otherwise run
+    unbounded. The budget left at submit time is what the work gets.
+    """
+    active = getattr(_local, 'deadline', None)
+    if active is None:
+        return executor.submit(fn, *args, **kwargs)
+
+    def run():
+        with deadline(active - time.monotonic()):
+            return fn(*args, **kwargs)
+    return executor.submit(run)
+
+
+class DeadlineAdapter(HTTPAdapter):
+    """HTTPAdapter with a default timeout that also honours the active deadline()."""
+
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, timeout=None, **kwargs):
+        timeout = timeout or self.timeout
+        active = getattr(_local, 'deadline', None)
+        if active is not None:
+            remaining = active - time.monotonic()
+            if remaining <= 0:
+                raise UpstreamTimeout(f"Deadline exceeded before requesting {request.url}", request=request)
+            timeout = remaining if isinstance(timeout, tuple) else min(timeout, remaining)
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+def pooled_session(timeout, pool_size=10, headers=None):
+    """A keep-alive requests.Session with a bounded connection pool and default timeout."""
+    session = requests.Session()
+    adapter = DeadlineAdapter(timeout, pool_connections=4, pool_maxsize=pool_size)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures and rejects calls for
+    `reset_timeout` seconds, then lets a single trial call through (half-open)."""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+class _Flight:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesces identical concurrent calls: followers wait for the leader's result.
+
+    The result object is shared between all callers, so treat it as read-only.
+    """
+
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.coalesced = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+
+
+class Upstream:
+    """A single upstream service: per-call deadline, circuit breaker and single-flight."""
+
+    def __init__(self, name, timeout, failure_threshold=5, reset_timeout=30,
+                 failure_exceptions=(requests.exceptions.RequestException,), observe=None):
+        self.name = name
+        self.observe = observe  # (name, key, seconds, outcome) after each call that went out
+        self.timeout = timeout
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.failure_exceptions = failure_exceptions
+        self.flights = SingleFlight()
+        self.calls = 0
+        self.errors = 0
+        self.rejected = 0
+
+    def call(self, key, fn, *args, **kwargs):
+        return self.flights.do(key, lambda: self._call(key, fn, args, kwargs))
+
+    def _call(self, key, fn, args, kwargs):
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise UpstreamUnavailable(f"{self.name} is unavailable (circuit open)")
+        self.calls += 1
+        start = time.perf_counter()
+        try:
+            with deadline(self.timeout):
+                result = fn(*args, **kwargs)
+        except self.failure_exceptions:
+            self.errors += 1
+            self.breaker.record_failure()
+            self._observe(key, start, 'error')
+            raise
+        except Exception:
+            # The upstream answered, we just couldn't use the answer
+            self.errors += 1
+            self.breaker.record_success()
+            self._observe(key, start, 'bad_response')
+            raise
+        self.breaker.record_success()
+        self._observe(key, start, 'ok')
+        return result
+
+    def _observe(self, key, start, outcome):
+        if self.observe:
+            self.observe(self.name, key, time.perf_counter() - start, outcome)
+
+    def stats(self):
+        return {
+            'state': self.breaker.state,
+            'calls': self.calls,
+            'errors': self.errors,
+            'rejected': self.rejected,
+            'coalesced': self.flights.coalesced,
+        }
+
+
+class Gateway:
+    """Registry of upstreams that every route goes through."""
+
+    def __init__(self, observe=None):
+        self.upstreams = {}
+        self.observe = observe
+
+    def register(self, name, timeout, **kwargs):
+        kwargs.setdefault('observe', self.observe)
+        self.upstreams[name] = Upstream(name, timeout, **kwargs)
+        return self.upstreams[name]
+
+    def call(self, name, key, fn, *args, **kwargs):
+        return self.upstreams[name].call((name, key), fn, *args, **kwargs)
+
+    def degraded(self):
+        return [name for name, upstream in self.upstreams.items() if upstream.breaker.state != 'closed']
+
+    def stats(self):
+        return {name: upstream.stats() for name, upstream in self.upstreams.items()}
+
+
+def bounded_map(executor, fn, items, limit):
+    """Runs fn over items on the executor with at most `limit` calls in flight.
+
+    Returns results in input order; a call that raised yields its exception.
+    The calls share the caller's deadline(), if any.
+    """
+    items = list(items)
+    results = [None] * len(items)
+    pending = iter(enumerate(items))
+    in_flight = {}
+
+    def submit_next():
+        for index, item in pending:
+            in_flight[submit_with_deadline(executor, fn, item)] = index
+            return
+
+    for _ in range(limit):
+        submit_next()
+    while in_flight:
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            index = in_flight.pop(future)
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                results[index] = e
+            submit_next()
+    return results
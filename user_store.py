@@ -0,0 +1,244 @@
+import json
+import threading
+import time
+
+from storage import Database, WriteBehind
+
+USERS_DB = 'aura_users.db'
+HISTORY_LIMIT = 50  # Matches the client's recentSongs cap
+
+
+class SyncConflict(Exception):
+    """The client's base revision is behind the server's."""
+
+    def __init__(self, rev):
+        super().__init__(f"Revision conflict, server is at {rev}")
+        self.rev = rev
+
+
+class InvalidPatch(Exception):
+    pass
+
+
+class UserStore:
+    """Per-collection storage for user libraries with a revision counter.
+
+    Liked songs, history and playlists live in their own tables so a sync only
+    touches the rows a patch changes. Every accepted write bumps `users.rev`;
+    clients send the revision they last saw and get a SyncConflict when another
+    device got there first. Accepted syncs are queued and committed in batches,
+    with repeated syncs from one user merged into a single write.
+
+    Patch ops:
+        {'op': 'like', 'track': {...}}            append to liked songs
+        {'op': 'unlike', 'id': ...}
+        {'op': 'history', 'track': {...}}         move/add to the front of history
+        {'op': 'playlist_put', 'name': ..., 'playlist': {'tracks': [...], 'cover': ...}}
+        {'op': 'playlist_delete', 'name': ...}
+    """
+
+    def __init__(self, db=None, write_window=0.5, spawn=None, sleep=time.sleep):
+        self.db = db or Database(USERS_DB)
+        # Syncs are acknowledged right away and committed in batches every
+        # `write_window` seconds; 0 writes each sync in its own transaction.
+        self.writes = WriteBehind(self.db, self._flush, window=write_window, spawn=spawn, sleep=sleep,
+                                  on_done=self._flushed)
+        self._revs = {}  # google_id -> rev including queued writes, only while some are queued
+        self._lock = threading.Lock()
+        # Guards _revs. Taken inside a flush, so never held while waiting on one
+        self._revs_lock = threading.Lock()
+        with self.db.transaction() as conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(users)")]
+            if 'rev' not in columns:
+                conn.execute("ALTER TABLE users ADD COLUMN rev INTEGER NOT NULL DEFAULT 0")
+            conn.execute('''CREATE TABLE IF NOT EXISTS liked_songs
+                            (google_id TEXT, song_id TEXT, position INTEGER, track TEXT,
+                             PRIMARY KEY (google_id, song_id))''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS history
+                            (google_id TEXT, song_id TEXT, seq INTEGER, track TEXT,
+                             PRIMARY KEY (google_id, song_id))''')
+            conn.execute('''CREATE TABLE IF NOT EXISTS playlists
+                            (google_id TEXT, name TEXT, tracks TEXT, cover TEXT,
+                             PRIMARY KEY (google_id, name))''')
+
+    def login(self, google_id, email):
+        """Creates the user if needed and returns (data, rev)."""
+        with self._lock:
+            self.writes.flush()
+            with self.db.transaction() as conn:
+                row = conn.execute("SELECT data, rev FROM users WHERE google_id = ?", (google_id,)).fetchone()
+                if row is None:
+                    # New user
+                    conn.execute("INSERT INTO users (google_id, email, data, rev) VALUES (?, ?, NULL, 0)", (google_id, email))
+                elif row[0] and row[0] != '{}':
+                    # Library saved before per-collection sync: move the blob into the tables once
+                    self._replace(conn, google_id, json.loads(row[0]))
+                    conn.execute("UPDATE users SET data = NULL, rev = rev + 1 WHERE google_id = ?", (google_id,))
+                with self._revs_lock:
+                    self._revs.pop(google_id, None)
+                return self._load(conn, google_id)
+
+    def revision(self, google_id):
+        with self._revs_lock:
+            if google_id in self._revs:
+                return self._revs[google_id]
+        rows = self.db.execute("SELECT rev FROM users WHERE google_id = ?", (google_id,))
+        return rows[0][0] if rows else None
+
+    def load(self, google_id):
+        """Returns (data, rev) with any queued writes for the user committed first."""
+        with self._lock:
+            self.writes.flush()
+            with self._revs_lock:
+                self._revs.pop(google_id, None)
+            with self.db.transaction() as conn:
+                return self._load(conn, google_id)
+
+    def _load(self, conn, google_id):
+        row = conn.execute("SELECT rev FROM users WHERE google_id = ?", (google_id,)).fetchone()
+        liked = conn.execute("SELECT track FROM liked_songs WHERE google_id = ? ORDER BY position", (google_id,))
+        history = conn.execute("SELECT track FROM history WHERE google_id = ? ORDER BY seq DESC", (google_id,))
+        playlists = conn.execute("SELECT name, tracks, cover FROM playlists WHERE google_id = ? ORDER BY rowid", (google_id,))
+        data = {
+            'likedSongs': [json.loads(r[0]) for r in liked],
+            'recentSongs': [json.loads(r[0]) for r in history],
+            'playlists': {r[0]: {'tracks': json.loads(r[1]), 'cover': r[2]} for r in playlists},
+        }
+        return data, (row[0] if row else 0)
+
+    def write(self, google_id, base_rev=None, patches=(), data=None):
+        """Accepts patches (or a full `data` replacement) and returns the new rev.
+
+        Raises SyncConflict when base_rev is given and isn't the current revision,
+        and InvalidPatch before anything is queued if a patch is malformed.
+        """
+        patches = list(patches)
+        for patch in (self._replacement_patches(data) if data is not None else []) + patches:
+            self._validate(patch)
+
+        if self.writes.window <= 0:
+            with self.db.transaction() as conn:
+                row = conn.execute("SELECT rev FROM users WHERE google_id = ?", (google_id,)).fetchone()
+                if row is None:
+                    raise InvalidPatch('Unknown user, log in first')
+                if base_rev is not None and base_rev != row[0]:
+                    raise SyncConflict(row[0])
+                self._flush(conn, google_id, [(data, patches)])
+                return row[0] + 1
+
+        # Revisions are tracked in memory while writes are queued, which assumes
+        # a user's syncs all land on this process (the Procfile runs one worker)
+        with self._lock, self._revs_lock:
+            rev = self._revs.get(google_id)
+            if rev is None:
+                rows = self.db.execute("SELECT rev FROM users WHERE google_id = ?", (google_id,))
+                if not rows:
+                    raise InvalidPatch('Unknown user, log in first')
+                rev = rows[0][0]
+            if base_rev is not None and base_rev != rev:
+                raise SyncConflict(rev)
+            self._revs[google_id] = rev + 1
+            self.writes.submit(google_id, (data, patches))
+            return rev + 1
+
+    def _flushed(self, google_id, error):
+        # Once nothing is queued the database has the revision again. A dropped
+        # write never reaches it: forget the rev handed out for it, so the
+        # client's next sync gets a conflict and reloads what was stored.
+        with self._revs_lock:
+            if error is not None or not self.writes.is_pending(google_id):
+                self._revs.pop(google_id, None)
+
+    def _flush(self, conn, google_id, items):
+        # A full replacement makes everything queued before it moot
+        start = max([i for i, (data, _) in enumerate(items) if data is not None], default=0)
+        for data, patches in items[start:]:
+            if data is not None:
+                self._replace(conn, google_id, data)
+            for patch in patches:
+                self._apply(conn, google_id, patch)
+        conn.execute("UPDATE users SET rev = rev + ? WHERE google_id = ?", (len(items), google_id))
+
+    @staticmethod
+    def _replacement_patches(data):
+        if not isinstance(data, dict):
+            raise InvalidPatch('data must be an object')
+        liked, recent, playlists = data.get('likedSongs') or [], data.get('recentSongs') or [], data.get('playlists') or {}
+        for name, songs in (('likedSongs', liked), ('recentSongs', recent)):
+            if not isinstance(songs, list) or not all(isinstance(song, dict) for song in songs):
+                raise InvalidPatch(f"{name} must be a list of tracks")
+        if not isinstance(playlists, dict):
+            raise InvalidPatch('playlists must be an object')
+        patches = [{'op': 'like', 'track': track} for track in liked]
+        patches += [{'op': 'history', 'track': track} for track in reversed(recent[:HISTORY_LIMIT])]
+        patches += [{'op': 'playlist_put', 'name': name, 'playlist': playlist} for name, playlist in playlists.items()]
+        return patches
+
+    def _replace(self, conn, google_id, data):
+        for table in ('liked_songs', 'history', 'playlists'):
+            conn.execute(f"DELETE FROM {table} WHERE google_id = ?", (google_id,))
+        # Only reachable for libraries saved before validation existed: skip what can't be stored
+        try:
+            patches = self._replacement_patches(data)
+        except InvalidPatch as e:
+            print(f"Skipping Invalid Library ({google_id}): {e}")
+            return
+        for patch in patches:
+            try:
+                self._apply(conn, google_id, patch)
+            except InvalidPatch as e:
+                print(f"Skipping Invalid Library Entry ({google_id}): {e}")
+
+    @staticmethod
+    def _validate(patch):
+        op = patch.get('op') if isinstance(patch, dict) else None
+        # Everything bound into SQLite has to be a type it can store
+        if op in ('like', 'history'):
+            track = patch.get('track')
+            if not (isinstance(track, dict) and isinstance(track.get('id'), str) and track['id']):
+                raise InvalidPatch(f"'{op}' needs a track with an id")
+        elif op == 'playlist_put':
+            playlist = patch.get('playlist')
+            if not (isinstance(patch.get('name'), str) and patch['name']) or not isinstance(playlist, (dict, list)):
+                raise InvalidPatch("'playlist_put' needs a name and a playlist")
+            if isinstance(playlist, dict):
+                if not isinstance(playlist.get('tracks', []), list):
+                    raise InvalidPatch("A playlist's tracks must be a list")
+                if not isinstance(playlist.get('cover'), (str, type(None))):
+                    raise InvalidPatch("A playlist's cover must be a string")
+        elif op == 'unlike':
+            if not isinstance(patch.get('id'), str):
+                raise InvalidPatch("'unlike' needs an id")
+        elif op == 'playlist_delete':
+            if not isinstance(patch.get('name'), str):
+                raise InvalidPatch("'playlist_delete' needs a name")
+        else:
+            raise InvalidPatch(f"Unknown op: {op}")
+
+    def _apply(self, conn, google_id, patch):
+        self._validate(patch)
+        op = patch['op']
+        track = patch.get('track')
+
+        if op == 'like':
+            conn.execute('''INSERT OR IGNORE INTO liked_songs (google_id, song_id, position, track)
+                            VALUES (?, ?, (SELECT COALESCE(MAX(position), 0) + 1 FROM liked_songs WHERE google_id = ?), ?)''',
+                         (google_id, track['id'], google_id, json.dumps(track)))
+        elif op == 'unlike':
+            conn.execute("DELETE FROM liked_songs WHERE google_id = ? AND song_id = ?", (google_id, patch.get('id')))
+        elif op == 'history':
+            conn.execute('''INSERT OR REPLACE INTO history (google_id, song_id, seq, track)
+                            VALUES (?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM history WHERE google_id = ?), ?)''',
+                         (google_id, track['id'], google_id, json.dumps(track)))
+            conn.execute('''DELETE FROM history WHERE google_id = ? AND seq <=
+                            (SELECT seq FROM history WHERE google_id = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)''',
+                         (google_id, google_id, HISTORY_LIMIT))
+        elif op == 'playlist_put':
+            playlist = patch.get('playlist')
+            if isinstance(playlist, list):  # Old format: a bare list of tracks
+                playlist = {'tracks': playlist, 'cover': None}
+            conn.execute('''INSERT INTO playlists (google_id, name, tracks, cover) VALUES (?, ?, ?, ?)
+                            ON CONFLICT(google_id, name) DO UPDATE SET tracks = excluded.tracks, cover = excluded.cover''',
+                         (google_id, patch['name'], json.dumps(playlist.get('tracks') or []), playlist.get('cover')))
+        elif op == 'playlist_delete':
+            conn.execute("DELETE FROM playlists WHERE google_id = ? AND name = ?", (google_id, patch.get('name')))